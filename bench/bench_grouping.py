@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+'''
+Measures continuous shooting detection over a large number of frames:
+the pairwise isContinuousShooting() loop against the flags computed on
+extracted columns, in pure Python and with NumPy when it is installed.
+
+    python bench/bench_grouping.py [num_frames]
+'''
+import os
+import sys
+import time
+import random
+import datetime
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from photo_view import item
+
+
+def makeImages( num_frames ):
+    '''
+    Bursts of 1 to 20 frames a few minutes apart, with a few gaps in the
+    file numbering and some frames shot in the same second.
+    '''
+    rnd = random.Random( 0 )
+    now = datetime.datetime( 2024, 1, 1, 8 )
+    images = []
+    number = 0
+    sequence = 0
+    while len(images) < num_frames:
+        now += datetime.timedelta( minutes=rnd.randint( 1, 30 ) )
+        for i in range( rnd.randint( 1, 20 ) ):
+            now += datetime.timedelta( milliseconds=rnd.choice( (100, 200, 500, 1500) ) )
+            number += rnd.choice( (1, 1, 1, 2) )
+            sequence += 1
+            info = item.PV_ImageInfo( 0, 0, now, sequence_number=sequence )
+            images.append( item.PV_ARW( '/DCIM/DSC%05d.ARW' % (number % 100000), info ) )
+    return images[:num_frames]
+
+
+def pairwise( images ):
+    return [item.isContinuousShooting( a, b ) for a, b in zip( images, images[1:] )]
+
+
+def timeit( label, func, repeat=3 ):
+    start = time.perf_counter()
+    for i in range( repeat ):
+        result = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print('%-32s %10.3f msec' % (label, elapsed * 1000))
+    return result
+
+
+def main():
+    num_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    images = makeImages( num_frames )
+    threshold = int(item.config.data.get('continuous_shoot_threshold_sec')) or 1
+    print('%d frames' % num_frames)
+
+    expected = timeit( 'isContinuousShooting pairs', lambda: pairwise( images ) )
+    columns = timeit( 'getShootingColumns', lambda: item.getShootingColumns( images ) )
+    flags = timeit( 'flags (python)', lambda: item._continuousFlags( columns, threshold ) )
+    print('  identical: %s' % (flags == expected))
+    if item.numpy is not None:
+        flags = timeit( 'flags (numpy)', lambda: item._continuousFlagsNumpy( columns, threshold ) )
+        print('  identical: %s' % (flags == expected))
+    else:
+        print('numpy is not installed')
+    # like the loader: the images are in their date groups first
+    item.groupImagesByDay( images )
+    groups = timeit( 'groupImagesByContinuousShooting', lambda: item.groupImagesByContinuousShooting( images ), 1 )
+    print('  %d groups' % len(groups))
+
+
+if __name__ == '__main__':
+    main()
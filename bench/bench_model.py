@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+'''
+Measures building a date group holding a large burst, and the cost of
+the row lookups PV_Model.parent() does while Qt walks the tree.
+
+    python bench/bench_model.py [num_frames]
+'''
+import os
+import sys
+import time
+import datetime
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from photo_view import item
+
+
+def makeImages( num_frames ):
+    start = datetime.datetime( 2024, 1, 1, 10 )
+    images = []
+    for i in range( num_frames ):
+        info = item.PV_ImageInfo( 0, 0, start + datetime.timedelta( seconds=i // 10 ), sequence_number=i+1 )
+        images.append( item.PV_ARW( '/DCIM/DSC%05d.ARW' % i, info ) )
+    return images
+
+
+def addEach( images ):
+    group = item.PV_DateGroupItem( images[0].datetime )
+    for image in images:
+        group.addChild( image )
+    return group
+
+
+def addAll( images ):
+    group = item.PV_DateGroupItem( images[0].datetime )
+    group.addChildren( images )
+    return group
+
+
+def timeit( label, func, repeat, setup=None ):
+    '''
+    Times func, called with the result of setup when given. setup runs
+    before each call, outside the timing.
+    '''
+    elapsed = 0.0
+    for i in range( repeat ):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        func( *args )
+        elapsed += time.perf_counter() - start
+    print('%-32s %10.3f msec' % (label, elapsed / repeat * 1000))
+
+
+def main():
+    num_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    print('%d frames in one date group' % num_frames)
+
+    # fresh items for each run, so adding them never moves them out of a
+    # previous group first
+    fresh = lambda: makeImages( num_frames )
+    timeit( 'addChild per frame', addEach, 3, fresh )
+    timeit( 'addChildren', addAll, 3, fresh )
+    timeit( 'groupImagesByDay', item.groupImagesByDay, 3, fresh )
+
+    group = addAll( makeImages( num_frames ) )
+    children = group.children
+
+    # one parent() lookup per visible child, as done by painting/selection
+    timeit( 'children.index(node) per row', lambda: [node.parent.children.index(node) for node in children], 3 )
+    timeit( 'node.row per row', lambda: [node.row for node in children], 3 )
+    assert [node.row for node in children] == list( range( num_frames ) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+'''
+Compares the chained orientation transforms with the single combined
+transforms for the 8 EXIF orientations: time, number of transformed
+copies per image, and whether both give the same format and the same
+pixels. Exits with 1 on a mismatch.
+
+    python bench/bench_orient.py [width] [height]
+'''
+import os
+import sys
+import time
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from photo_view.imaging import orientPixmap
+
+
+class CountingImage( object ):
+    '''
+    Wraps a QImage and counts the copies made by transformed().
+    '''
+    copies = 0
+
+    def __init__( self, image ):
+        self.image = image
+
+    def transformed( self, transform ):
+        CountingImage.copies += 1
+        return CountingImage( self.image.transformed( transform ) )
+
+
+def orientChained( pixmap, exif_orientation ):
+    if exif_orientation == 2:
+        pixmap = pixmap.transformed( QtGui.QTransform().scale(-1, 1) )
+    elif exif_orientation == 3:
+        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 180 ) )
+    elif exif_orientation == 4:
+        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 180 ) )
+        pixmap = pixmap.transformed( QtGui.QTransform().scale(-1, 1) )
+    elif exif_orientation == 5:
+        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 90 ) )
+        pixmap = pixmap.transformed( QtGui.QTransform().scale(-1, 1) )
+    elif exif_orientation == 6:
+        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 90 ) )
+    elif exif_orientation == 7:
+        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 270 ) )
+        pixmap = pixmap.transformed( QtGui.QTransform().scale(-1, 1) )
+    elif exif_orientation == 8:
+        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 270 ) )
+    return pixmap
+
+
+def makeImage( width, height ):
+    image = QtGui.QImage( width, height, QtGui.QImage.Format_RGB32 )
+    painter = QtGui.QPainter( image )
+    gradient = QtGui.QLinearGradient( 0, 0, width, height )
+    gradient.setColorAt( 0, QtCore.Qt.red )
+    gradient.setColorAt( 1, QtCore.Qt.blue )
+    painter.fillRect( image.rect(), gradient )
+    painter.fillRect( 0, 0, width // 4, height // 8, QtCore.Qt.white )
+    painter.end()
+    return image
+
+
+def measure( func, image, orientation, repeat=5 ):
+    CountingImage.copies = 0
+    start = time.perf_counter()
+    for i in range( repeat ):
+        result = func( CountingImage( image ), orientation )
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed, CountingImage.copies // repeat, result.image
+
+
+def main():
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 1616
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 1080
+    image = makeImage( width, height )
+    print('%dx%d image' % (width, height))
+    print('%-12s %12s %8s %12s %8s %7s %7s' % ('orientation', 'chained ms', 'copies', 'combined ms', 'copies',
+                                                'format', 'pixels'))
+    mismatches = []
+    for orientation in range( 1, 9 ):
+        chained_time, chained_copies, chained = measure( orientChained, image, orientation )
+        combined_time, combined_copies, combined = measure( orientPixmap, image, orientation )
+        same_format = chained.format() == combined.format()
+        # compare the pixels in one format, so a format change is only
+        # reported in its own column
+        same_pixels = chained.convertToFormat( image.format() ) == combined.convertToFormat( image.format() )
+        print('%-12d %12.2f %8d %12.2f %8d %7s %7s' % (orientation,
+                                                      chained_time * 1000, chained_copies,
+                                                      combined_time * 1000, combined_copies,
+                                                      same_format, same_pixels))
+        if not same_format:
+            mismatches.append( 'orientation %d: format %s instead of %s' % (orientation, combined.format(), chained.format()) )
+        if not same_pixels:
+            mismatches.append( 'orientation %d: different pixels' % orientation )
+    for mismatch in mismatches:
+        print('MISMATCH %s' % mismatch)
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+'''
+Compares the os.walk + regex findImages with the scandir scanner on a
+synthetic tree.
+
+    python bench/bench_scan.py [num_files]
+'''
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from photo_view import item
+
+
+def findImagesWalk( root_dir, extensions ):
+    extensions_pattern = '(' + '|'.join(extensions) + ')$'
+    images = []
+    for root, dirs, files in os.walk(root_dir):
+        for file in files:
+            if re.search( extensions_pattern, file ):
+                images.append( os.path.join(root, file) )
+    return sorted(images)
+
+
+def makeTree( root_dir, num_files, files_per_dir=1000 ):
+    suffixes = ['.ARW', '.JPG', '.XML', '.arw']
+    for i in range( num_files ):
+        folder = os.path.join( root_dir, 'DCIM', '%03dMSDCF' % (i // files_per_dir) )
+        if i % files_per_dir == 0:
+            os.makedirs( folder )
+        path = os.path.join( folder, 'DSC%05d%s' % (i % files_per_dir, suffixes[i % len(suffixes)]) )
+        open( path, 'w' ).close()
+
+
+def timeit( label, func ):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print('%-28s %8.3f sec' % (label, elapsed))
+    return result
+
+
+def main():
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    root_dir = tempfile.mkdtemp( prefix='pv_bench_scan_' )
+    try:
+        print('Creating %d files in %s' % (num_files, root_dir))
+        makeTree( root_dir, num_files )
+        extensions = ['ARW', 'JPG']
+        suffixes = set( ['.arw', '.jpg'] )
+
+        walked = timeit( 'os.walk + re.search', lambda: findImagesWalk( root_dir, extensions ) )
+        scanned = timeit( 'scanImages', lambda: [entry.path for entry in item.scanImages( [root_dir], suffixes )] )
+        timeit( 'scanImages first entry', lambda: next( item.scanImages( [root_dir], suffixes ) ) )
+        timeit( 'scanImages + stat', lambda: [entry.stat() for entry in item.scanImages( [root_dir], suffixes )] )
+
+        # the scanner also matches lowercase suffixes
+        print('os.walk: %d files, scanImages: %d files' % (len(walked), len(scanned)))
+        print('same order: %s' % (scanned == sorted(scanned)))
+    finally:
+        shutil.rmtree( root_dir )
+
+
+if __name__ == '__main__':
+    main()
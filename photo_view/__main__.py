@@ -0,0 +1,181 @@
+'''
+Command line entry point, without Qt:
+
+    python -m photo_view scan   [root ...]       images found under the roots
+    python -m photo_view index  [root ...]       fills the metadata index
+    python -m photo_view group  [root ...]       the tree shown by the GUI
+    python -m photo_view import DEST [root ...]  copies the images into DEST
+
+Each command prints a JSON summary on stdout; logs go to stderr. The
+roots default to 'image_root_dirs' (and 'movie_root_dirs' for group).
+'''
+from . import config
+from .item import scanImages, loadImages, loadMovies, groupImages, groupImagesByDay, PV_ImageItem, PV_MovieItem
+from .index import openMetadataIndex
+from .importer import PV_Importer
+from .logger import logger, setDebug
+
+import os
+import sys
+import json
+import time
+import argparse
+
+
+def getRoots( args, key='image_root_dirs' ):
+    if args.roots:
+        # absolute, like the configured roots the index is keyed by
+        return [os.path.abspath( root_dir ) for root_dir in args.roots]
+    return [root_dir for root_dir in config.data.get(key) or [] if os.path.exists( root_dir )]
+
+def openIndex( args ):
+    if args.no_index:
+        return None
+    return openMetadataIndex()
+
+def nodeToDict( node ):
+    if isinstance( node, (PV_ImageItem, PV_MovieItem) ):
+        return { 'name' : node.name, 'file' : node.data }
+    return { 'name' : node.name, 'children' : [nodeToDict( child ) for child in node.children] }
+
+def loadRoot( root_dir, index, args, counts ):
+    '''
+    Returns the image items of root_dir, counting the files scanned.
+    '''
+    def progress( count ):
+        counts[root_dir] = count
+    counts[root_dir] = 0
+    return loadImages( root_dir, index, args.workers, progress=progress ) or []
+
+
+def scanCommand( args ):
+    roots = []
+    for root_dir in getRoots( args ):
+        entries = list( scanImages( [root_dir] ) )
+        result = { 'root' : root_dir,
+                   'images' : len(entries),
+                   'bytes' : sum( [entry.stat().st_size for entry in entries] ) }
+        if args.list:
+            result['files'] = [entry.path for entry in entries]
+        roots.append( result )
+    return { 'roots' : roots }
+
+def indexCommand( args ):
+    index = openMetadataIndex()
+    if not index:
+        raise RuntimeError('The metadata index is disabled in the config')
+    roots = []
+    counts = {}
+    for root_dir in getRoots( args ):
+        items = loadRoot( root_dir, index, args, counts )
+        index.commit()
+        roots.append( { 'root' : root_dir,
+                        'files' : counts[root_dir],
+                        'images' : len(items),
+                        'failed' : counts[root_dir] - len(items) } )
+    index.close()
+    return { 'index' : index.path, 'roots' : roots }
+
+def groupCommand( args ):
+    index = openIndex( args )
+    roots = []
+    counts = {}
+    for root_dir in getRoots( args ):
+        dates = groupImages( loadRoot( root_dir, index, args, counts ) )
+        roots.append( { 'name' : root_dir, 'children' : [nodeToDict( date ) for date in dates] } )
+    if args.movie_roots:
+        movie_roots = [os.path.abspath( root_dir ) for root_dir in args.movie_roots]
+    elif args.roots:
+        movie_roots = []
+    else:
+        movie_roots = getRoots( args, 'movie_root_dirs' )
+    for root_dir in movie_roots:
+        dates = groupImagesByDay( loadMovies( root_dir, args.workers ) )
+        roots.append( { 'name' : root_dir, 'children' : [nodeToDict( date ) for date in dates] } )
+    if index:
+        index.close()
+    return { 'roots' : roots }
+
+def importCommand( args ):
+    index = openIndex( args )
+    counts = {}
+    files = []
+    for root_dir in getRoots( args ):
+        items = loadRoot( root_dir, index, args, counts )
+        # the date groups give the 'YYYY-MM-DD/name' destination paths
+        dates = groupImagesByDay( items )
+        for date in dates:
+            if args.days and date.name not in args.days:
+                continue
+            files.extend( [(item.data, item.path) for item in date.children] )
+
+    importer = PV_Importer( args.dest,
+                            workers=args.workers,
+                            verify=args.verify or None,
+                            dedupe=False if args.no_dedupe else None,
+                            index=index )
+    copied, stats = importer.run( files, args.action )
+    if index:
+        index.close()
+    result = stats.summary()
+    result['dest'] = args.dest
+    return result
+
+
+def getParser():
+    parser = argparse.ArgumentParser( prog='python -m photo_view',
+                                      description='Scans, indexes, groups and imports images without the GUI.' )
+    parser.add_argument( '--debug', action='store_true', help='debug logging' )
+    commands = parser.add_subparsers( dest='command', required=True )
+
+    def addCommand( name, func, help ):
+        command = commands.add_parser( name, help=help )
+        command.set_defaults( func=func )
+        command.add_argument( '--workers', type=int, default=None,
+                              help='threads reading metadata or copying files (default from the config)' )
+        return command
+
+    command = addCommand( 'scan', scanCommand, 'count the images under the roots' )
+    command.add_argument( '--list', action='store_true', help='include the image paths' )
+    command.add_argument( 'roots', nargs='*' )
+
+    command = addCommand( 'index', indexCommand, 'read the metadata of new images into the metadata index' )
+    command.add_argument( 'roots', nargs='*' )
+
+    command = addCommand( 'group', groupCommand, 'print the date and continuous shoot groups' )
+    command.add_argument( '--no-index', action='store_true', help='do not use the metadata index' )
+    command.add_argument( '--movie-root', dest='movie_roots', action='append', default=None,
+                          help="movie root to group instead of 'movie_root_dirs' (repeatable)" )
+    command.add_argument( 'roots', nargs='*' )
+
+    command = addCommand( 'import', importCommand, 'copy the images to DEST/YYYY-MM-DD/' )
+    command.add_argument( '--no-index', action='store_true', help='do not use the metadata index' )
+    command.add_argument( '--action', choices=('skip', 'replace'), default='skip',
+                          help='for existing files with a different content' )
+    command.add_argument( '--day', dest='days', action='append', default=None,
+                          help='only import this YYYY-MM-DD day (repeatable)' )
+    command.add_argument( '--verify', action='store_true', help='check each copy against a hash of its source' )
+    command.add_argument( '--no-dedupe', action='store_true', help='copy files even when already imported' )
+    command.add_argument( 'dest' )
+    command.add_argument( 'roots', nargs='*' )
+    return parser
+
+def main( argv=None ):
+    args = getParser().parse_args( argv )
+    if args.debug:
+        setDebug()
+    start = time.perf_counter()
+    try:
+        result = args.func( args )
+    except Exception as err:
+        logger.error(err)
+        result = { 'error' : str(err) }
+    result['command'] = args.command
+    result['seconds'] = round( time.perf_counter() - start, 3 )
+    json.dump( result, sys.stdout, indent=2, default=str )
+    sys.stdout.write('\n')
+    return 1 if 'error' in result else 0
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
@@ -0,0 +1,100 @@
+from . import config
+from .logger import logger
+
+import collections
+
+
+VARIANTS = ( 'icon', 'preview', 'composite', 'scaled' )
+
+
+def cacheKey( node, variant, size=None ):
+    '''
+    Key of a pixmap made from node. The file path and mtime keep images
+    with the same name on different cards apart, and drop stale entries
+    when a file is rewritten.
+    '''
+    info = getattr( node, 'info', None )
+    mtime = info.mtime if info else 0
+    if size is not None:
+        size = (size.width(), size.height())
+    return (node.data, mtime, variant, size)
+
+
+def scaledKey( key, size ):
+    '''
+    Key of the pixmap cached under key, scaled to size.
+    '''
+    return (key[0], key[1], 'scaled', (key[2], size.width(), size.height()))
+
+
+class PV_PixmapCache( object ):
+    '''
+    LRU cache of pixmaps with a separate byte budget per variant, set by
+    'pixmap_cache_budgets' in KB.
+    '''
+    def __init__( self, budgets=None ):
+        if budgets is None:
+            budgets = config.data.get('pixmap_cache_budgets') or {}
+        self.budgets = dict( [(variant, (budgets.get(variant) or 65536) * 1024) for variant in VARIANTS] )
+        self._entries = dict( [(variant, collections.OrderedDict()) for variant in VARIANTS] )
+        self._bytes = dict( [(variant, 0) for variant in VARIANTS] )
+        self.hits = dict( [(variant, 0) for variant in VARIANTS] )
+        self.misses = dict( [(variant, 0) for variant in VARIANTS] )
+
+    def find( self, key ):
+        variant = key[2]
+        entries = self._entries[variant]
+        entry = entries.get( key )
+        if entry is None:
+            self.misses[variant] += 1
+            return None
+        entries.move_to_end( key )
+        self.hits[variant] += 1
+        return entry[0]
+
+    def contains( self, key ):
+        return key in self._entries[key[2]]
+
+    def insert( self, key, pixmap ):
+        variant = key[2]
+        size = pixmap.width() * pixmap.height() * max( pixmap.depth(), 8 ) // 8
+        if size > self.budgets[variant]:
+            logger.debug('Not caching %s: %d bytes over the %s budget' % (key[0], size, variant))
+            return False
+        self.remove( key )
+        self._entries[variant][key] = (pixmap, size)
+        self._bytes[variant] += size
+        self._evict( variant )
+        return True
+
+    def remove( self, key ):
+        variant = key[2]
+        entry = self._entries[variant].pop( key, None )
+        if entry:
+            self._bytes[variant] -= entry[1]
+
+    def clear( self ):
+        for variant in VARIANTS:
+            self._entries[variant].clear()
+            self._bytes[variant] = 0
+
+    def _evict( self, variant ):
+        entries = self._entries[variant]
+        evicted = 0
+        while self._bytes[variant] > self.budgets[variant]:
+            key, (pixmap, size) = entries.popitem( last=False )
+            self._bytes[variant] -= size
+            evicted += 1
+        if evicted:
+            logger.debug('Evicted %d %s pixmaps' % (evicted, variant))
+
+    def stats( self ):
+        return ', '.join( ['%s: %d hits/%d misses, %d items, %d KB' % (variant,
+                                                                        self.hits[variant],
+                                                                        self.misses[variant],
+                                                                        len(self._entries[variant]),
+                                                                        self._bytes[variant] // 1024)
+                           for variant in VARIANTS] )
+
+
+pixmap_cache = PV_PixmapCache()
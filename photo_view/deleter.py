@@ -0,0 +1,110 @@
+from PySide6 import QtCore
+
+from .item import TRASH_FOLDER
+from .logger import logger
+
+import os
+import shutil
+
+
+def getTrashFolder( root_dir ):
+    if not TRASH_FOLDER:
+        return None
+    return os.path.join( root_dir, TRASH_FOLDER )
+
+def getRootDir( path, root_dirs ):
+    for root_dir in root_dirs:
+        if path.startswith( root_dir.rstrip( os.sep ) + os.sep ):
+            return root_dir
+    return None
+
+def deleteFiles( paths, root_dirs=() ):
+    '''
+    Deletes paths. With 'delete_trash_folder' set, they are all moved into
+    the trash folder of their root first, which is a rename, and the trash
+    is emptied afterwards. Returns the number of files that could not be
+    deleted.
+    '''
+    failed = 0
+    to_remove = []
+    trash_folders = set()
+    for path in paths:
+        root_dir = getRootDir( path, root_dirs )
+        trash_folder = getTrashFolder( root_dir ) if root_dir else None
+        if trash_folder:
+            trash_path = os.path.join( trash_folder, os.path.relpath( path, root_dir ) )
+            try:
+                os.makedirs( os.path.dirname( trash_path ), exist_ok=True )
+                os.replace( path, trash_path )
+                trash_folders.add( trash_folder )
+                continue
+            except OSError as err:
+                # another file system, delete it in place
+                logger.debug('Unable to move %s to trash: %s' % (path, err))
+        to_remove.append( path )
+
+    for path in to_remove:
+        logger.debug('Deleting %s' % path )
+        try:
+            os.remove( path )
+        except OSError as err:
+            logger.error(err)
+            failed += 1
+    for trash_folder in trash_folders:
+        emptyTrash( trash_folder )
+    return failed
+
+def emptyTrash( trash_folder ):
+    if os.path.isdir( trash_folder ):
+        logger.debug('Emptying %s' % trash_folder )
+        shutil.rmtree( trash_folder, ignore_errors=True )
+
+
+class PV_DeleteSignals( QtCore.QObject ):
+    finished = QtCore.Signal( int, int )
+
+
+class PV_DeleteJob( QtCore.QRunnable ):
+    def __init__( self, paths, root_dirs, signals ):
+        super( PV_DeleteJob, self ).__init__()
+        self.paths = paths
+        self.root_dirs = root_dirs
+        self.signals = signals
+
+    def run( self ):
+        failed = len(self.paths)
+        try:
+            failed = deleteFiles( self.paths, self.root_dirs )
+        except Exception as err:
+            logger.error(err)
+        self.signals.finished.emit( len(self.paths) - failed, failed )
+
+
+class PV_Deleter( QtCore.QObject ):
+    '''
+    Deletes image files on a worker thread, one batch after the other, so
+    the tree is updated before the files are gone.
+    '''
+    finished = QtCore.Signal( int, int )
+
+    def __init__( self, parent=None ):
+        super( PV_Deleter, self ).__init__( parent )
+        self.pool = QtCore.QThreadPool( self )
+        self.pool.setMaxThreadCount( 1 )
+        self.signals = PV_DeleteSignals( self )
+        self.signals.finished.connect( self.finished )
+
+    def delete( self, paths, root_dirs=() ):
+        self.pool.start( PV_DeleteJob( list(paths), list(root_dirs), self.signals ) )
+
+    def emptyTrash( self, root_dirs ):
+        '''
+        Removes what an interrupted delete left in the trash folders.
+        '''
+        for root_dir in root_dirs:
+            trash_folder = getTrashFolder( root_dir )
+            if trash_folder and os.path.isdir( trash_folder ):
+                self.pool.start( lambda folder=trash_folder: emptyTrash( folder ) )
+
+    def wait( self ):
+        self.pool.waitForDone()
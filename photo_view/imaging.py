@@ -0,0 +1,99 @@
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+import math
+
+
+def decodeSize( size, step=256 ):
+    '''
+    Rounds a display size up, so small resizes reuse the same decode.
+    '''
+    return QtCore.QSize( -(-size.width() // step) * step, -(-size.height() // step) * step )
+
+def decodePreview( data, orientation=1, size=None ):
+    '''
+    Decodes JPEG data to a QImage in the EXIF orientation. When size is
+    given the image is decoded to fit in it, which lets the JPEG decoder
+    downscale while decoding. QImage can be used off the GUI thread,
+    unlike QPixmap.
+    '''
+    image = QtGui.QImage()
+    if not data:
+        return image
+    if size is None:
+        image.loadFromData( data )
+        return orientPixmap( image, orientation )
+
+    buffer = QtCore.QBuffer()
+    buffer.setData( QtCore.QByteArray( data ) )
+    buffer.open( QtCore.QIODevice.ReadOnly )
+    reader = QtGui.QImageReader( buffer )
+    source_size = reader.size()
+    if orientation in (5, 6, 7, 8):
+        size = size.transposed()
+    if source_size.isValid() and (source_size.width() > size.width() or source_size.height() > size.height()):
+        reader.setScaledSize( source_size.scaled( size, QtCore.Qt.KeepAspectRatio ) )
+    image = reader.read()
+    return orientPixmap( image, orientation )
+
+def _orientationTransforms():
+    flip = QtGui.QTransform().scale( -1, 1 )
+    rotate90 = QtGui.QTransform().rotate( 90 )
+    rotate180 = QtGui.QTransform().rotate( 180 )
+    rotate270 = QtGui.QTransform().rotate( 270 )
+    # a * b applies a first, then b. Qt only keeps the source format for
+    # rotations and mirrors, so the transposes 5 and 7 stay two steps.
+    return { 2 : (flip,),
+             3 : (rotate180,),
+             4 : (rotate180 * flip,),
+             5 : (rotate90, flip),
+             6 : (rotate90,),
+             7 : (rotate270, flip),
+             8 : (rotate270,) }
+
+ORIENTATION_TRANSFORMS = _orientationTransforms()
+
+def orientPixmap( pixmap, exif_orientation ):
+    '''
+    Returns pixmap (or QImage) in the EXIF orientation and in its format,
+    with one transformed copy, two for orientations 5 and 7.
+    '''
+    for transform in ORIENTATION_TRANSFORMS.get( exif_orientation, () ):
+        pixmap = pixmap.transformed( transform )
+    return pixmap
+
+def contactSheetCells( count, size, spacing=4 ):
+    '''
+    Returns the rects of count cells laid out in a grid filling size.
+    '''
+    if count <= 0:
+        return []
+    columns = int( math.ceil( math.sqrt( count ) ) )
+    rows = -(-count // columns)
+    cell_width = max( (size.width() - spacing * (columns + 1)) // columns, 1 )
+    cell_height = max( (size.height() - spacing * (rows + 1)) // rows, 1 )
+    cells = []
+    for i in range( count ):
+        row, column = divmod( i, columns )
+        cells.append( QtCore.QRect( spacing + column * (cell_width + spacing),
+                                    spacing + row * (cell_height + spacing),
+                                    cell_width, cell_height ) )
+    return cells
+
+def contactSheet( images, cells, size ):
+    '''
+    Draws each image centered in its cell on a QImage of size, so it can
+    be rendered off the GUI thread.
+    '''
+    sheet = QtGui.QImage( size, QtGui.QImage.Format_ARGB32_Premultiplied )
+    sheet.fill( QtCore.Qt.darkGray )
+    painter = QtGui.QPainter( sheet )
+    painter.setRenderHint( QtGui.QPainter.SmoothPixmapTransform )
+    for image, cell in zip( images, cells ):
+        if image.isNull():
+            continue
+        target = QtCore.QRect( QtCore.QPoint(), image.size().scaled( cell.size(), QtCore.Qt.KeepAspectRatio ) )
+        target.moveCenter( cell.center() )
+        painter.drawImage( target, image )
+    painter.end()
+    return sheet
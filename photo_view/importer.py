@@ -0,0 +1,452 @@
+from . import config
+from .logger import logger
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import concurrent.futures
+
+
+JOURNAL_NAME = '.photo_view_import.jsonl'
+DUPLICATES_NAME = '.photo_view_duplicates.jsonl'
+PARTIAL_HASH_SIZE = 65536
+
+
+class PV_ImportStats( object ):
+    '''
+    Progress of an import. Files found in the journal, already in the
+    destination or skipped count as done, but not towards the throughput.
+    '''
+    __slots__ = ( 'total_files',
+                  'total_bytes',
+                  'files',
+                  'bytes',
+                  'copied_files',
+                  'copied_bytes',
+                  'duplicates',
+                  'skipped',
+                  'failed',
+                  'start' )
+
+    def __init__( self, total_files=0, total_bytes=0 ):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+
+    @property
+    def elapsed( self ):
+        return time.perf_counter() - self.start
+
+    @property
+    def mb_per_sec( self ):
+        return self.copied_bytes / 1048576.0 / max( self.elapsed, 1e-6 )
+
+    @property
+    def files_per_sec( self ):
+        return self.copied_files / max( self.elapsed, 1e-6 )
+
+    def summary( self ):
+        return { 'files' : self.files,
+                 'copied' : self.copied_files,
+                 'duplicates' : self.duplicates,
+                 'skipped' : self.skipped,
+                 'failed' : self.failed,
+                 'bytes' : self.copied_bytes,
+                 'seconds' : round( self.elapsed, 3 ),
+                 'mb_per_sec' : round( self.mb_per_sec, 1 ),
+                 'files_per_sec' : round( self.files_per_sec, 1 ) }
+
+
+class PV_ImportJournal( object ):
+    '''
+    JSON lines file in the destination folder, one line per copied file,
+    or per duplicate in the DUPLICATES_NAME file.
+    '''
+    def __init__( self, folder, name=JOURNAL_NAME ):
+        self.path = os.path.join( folder, name )
+        self._lock = threading.Lock()
+
+    def load( self ):
+        records = {}
+        try:
+            with open( self.path, 'r' ) as fp:
+                for line in fp:
+                    try:
+                        record = json.loads( line )
+                    except ValueError:
+                        # the last line of an interrupted import
+                        continue
+                    records[record['path']] = record
+        except OSError:
+            pass
+        return records
+
+    def append( self, record ):
+        line = json.dumps( record ) + '\n'
+        with self._lock:
+            with open( self.path, 'a' ) as fp:
+                fp.write( line )
+
+    def remove( self ):
+        try:
+            os.remove( self.path )
+        except OSError:
+            pass
+
+
+def findDuplicates( folder ):
+    '''
+    Returns the 'YYYY-MM-DD/name' paths not copied to folder because their
+    content was already there, while that file still exists.
+    '''
+    paths = set()
+    for rel_path, record in PV_ImportJournal( folder, DUPLICATES_NAME ).load().items():
+        existing = record.get('existing')
+        if existing and os.path.isfile( os.path.join( folder, existing ) ):
+            paths.add( rel_path )
+    return paths
+
+
+def _copyRange( fsrc, fdst, size ):
+    '''
+    Copies size bytes in the kernel with copy_file_range or sendfile.
+    Returns False when neither works for these files, before anything
+    is written.
+    '''
+    copied = 0
+    for name in ('copy_file_range', 'sendfile'):
+        func = getattr( os, name, None )
+        if func is None:
+            continue
+        try:
+            while copied < size:
+                if name == 'sendfile':
+                    sent = func( fdst.fileno(), fsrc.fileno(), copied, size - copied )
+                else:
+                    sent = func( fsrc.fileno(), fdst.fileno(), size - copied, copied, copied )
+                if not sent:
+                    raise IOError('Source truncated while copying')
+                copied += sent
+            return True
+        except OSError:
+            if copied:
+                raise
+    return False
+
+def _copyBuffered( fsrc, fdst, buffer_size, digest=None ):
+    buf = bytearray( buffer_size )
+    view = memoryview( buf )
+    while True:
+        n = fsrc.readinto( buf )
+        if not n:
+            break
+        if digest is not None:
+            digest.update( view[:n] )
+        fdst.write( view[:n] )
+
+def hashFile( path, buffer_size=1048576 ):
+    digest = hashlib.blake2b()
+    buf = bytearray( buffer_size )
+    view = memoryview( buf )
+    with open( path, 'rb' ) as fp:
+        while True:
+            n = fp.readinto( buf )
+            if not n:
+                break
+            digest.update( view[:n] )
+    return digest.hexdigest()
+
+def partialHash( path, size ):
+    '''
+    Hash of the size and the first and last PARTIAL_HASH_SIZE bytes of a
+    file, the whole file when it is smaller than both.
+    '''
+    digest = hashlib.blake2b( str(size).encode() )
+    with open( path, 'rb' ) as fp:
+        digest.update( fp.read( PARTIAL_HASH_SIZE ) )
+        if size > PARTIAL_HASH_SIZE * 2:
+            fp.seek( -PARTIAL_HASH_SIZE, os.SEEK_END )
+        digest.update( fp.read() )
+    return digest.hexdigest()
+
+
+class PV_HashCache( object ):
+    '''
+    Partial and full content hashes of files, computed when first needed
+    and valid while the size and mtime of the file are unchanged. They are
+    kept in the metadata index when there is one.
+    '''
+    def __init__( self, index=None ):
+        self.index = index
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def _get( self, path, st ):
+        key = (path, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            hashes = self._hashes.get( key )
+        if hashes is None:
+            stored = self.index.lookupHashes( path, st ) if self.index else None
+            hashes = list( stored or (None, None) )
+            with self._lock:
+                hashes = self._hashes.setdefault( key, hashes )
+        return hashes
+
+    def _store( self, path, st, hashes ):
+        if self.index:
+            self.index.storeHashes( path, st, hashes[0], hashes[1] )
+
+    def partial( self, path, st ):
+        hashes = self._get( path, st )
+        if hashes[0] is None:
+            hashes[0] = partialHash( path, st.st_size )
+            self._store( path, st, hashes )
+        return hashes[0]
+
+    def full( self, path, st ):
+        hashes = self._get( path, st )
+        if hashes[1] is None:
+            hashes[1] = hashFile( path )
+            self._store( path, st, hashes )
+        return hashes[1]
+
+    def setFull( self, path, st, digest ):
+        hashes = self._get( path, st )
+        hashes[1] = digest
+        self._store( path, st, hashes )
+
+
+def copyFile( src, dst, buffer_size=8388608, verify=False ):
+    '''
+    Copies src to dst with its stat like shutil.copy2, through a temporary
+    file so dst is never left half written. With verify the source is
+    hashed while it is copied and compared with a read back of dst; the
+    hex digest is returned.
+    '''
+    tmp_path = dst + '.part'
+    digest = None
+    try:
+        with open( src, 'rb' ) as fsrc, open( tmp_path, 'wb' ) as fdst:
+            if verify:
+                digest = hashlib.blake2b()
+                _copyBuffered( fsrc, fdst, buffer_size, digest )
+            elif not _copyRange( fsrc, fdst, os.fstat( fsrc.fileno() ).st_size ):
+                _copyBuffered( fsrc, fdst, buffer_size )
+        shutil.copystat( src, tmp_path )
+        if digest is not None and hashFile( tmp_path, buffer_size ) != digest.hexdigest():
+            raise IOError('Checksum mismatch: %s' % dst)
+        os.replace( tmp_path, dst )
+    except BaseException:
+        if os.path.exists( tmp_path ):
+            os.remove( tmp_path )
+        raise
+    return digest.hexdigest() if digest is not None else None
+
+
+class PV_Importer( object ):
+    '''
+    Copies images to rel_path under folder on 'import_workers' threads.
+    Each copied file is recorded in a journal in folder, so running an
+    interrupted import again skips what was already copied. The journal
+    is removed once an import completes.
+
+    With 'import_dedupe', files whose content is already anywhere in
+    folder are not copied, even under another name. Candidates are looked
+    up by size and partial hash, then confirmed by full hashes, all cached
+    in index.
+    '''
+    def __init__( self, folder, workers=None, buffer_size=None, verify=None, dedupe=None, index=None ):
+        self.folder = folder
+        self.workers = workers or config.data.get('import_workers') or 4
+        self.buffer_size = (buffer_size or config.data.get('import_buffer_size') or 8192) * 1024
+        self.verify = bool( config.data.get('import_verify') ) if verify is None else verify
+        self.dedupe = bool( config.data.get('import_dedupe') ) if dedupe is None else dedupe
+        self.index = index
+        self.hashes = PV_HashCache( index )
+        self.journal = PV_ImportJournal( folder )
+        self.duplicates = PV_ImportJournal( folder, DUPLICATES_NAME )
+        self._sizes = {}
+        self._canceled = threading.Event()
+
+    def cancel( self ):
+        self._canceled.set()
+
+    def isCanceled( self ):
+        return self._canceled.is_set()
+
+    def run( self, files, action='skip', progress=None ):
+        '''
+        Imports files, a list of (src, rel_path). Existing destinations
+        with a different content are replaced or skipped by action.
+        progress is called with the stats after each file, on the calling
+        thread. Returns the rel_paths now in the destination, under their
+        name or as duplicates, and the stats.
+        '''
+        journal = self.journal.load()
+        stats = PV_ImportStats( len(files) )
+        done = []
+        jobs = []
+        for src, rel_path in files:
+            try:
+                st = os.stat( src )
+            except OSError as err:
+                logger.error(err)
+                stats.failed += 1
+                continue
+            stats.total_bytes += st.st_size
+            dst = os.path.join( self.folder, rel_path )
+            record = journal.get( rel_path )
+            if record and self._isJournaled( record, src, st, dst ):
+                logger.debug('Already imported: %s' % rel_path )
+                done.append( rel_path )
+                stats.skipped += 1
+            else:
+                jobs.append( (src, rel_path, dst, st) )
+        stats.files = stats.skipped + stats.failed
+        self._sizes = {}
+        if self.dedupe and jobs:
+            self._sizes = self._destinationSizes( set( [job[3].st_size for job in jobs] ) )
+        if progress:
+            progress( stats )
+
+        with concurrent.futures.ThreadPoolExecutor( self.workers ) as executor:
+            futures = dict( [(executor.submit( self._import, action, *job ), job) for job in jobs] )
+            for future in concurrent.futures.as_completed( futures ):
+                src, rel_path, dst, st = futures[future]
+                stats.files += 1
+                try:
+                    result = future.result()
+                    if result == 'copied':
+                        done.append( rel_path )
+                        stats.copied_files += 1
+                        stats.copied_bytes += st.st_size
+                    elif result == 'duplicate':
+                        done.append( rel_path )
+                        stats.duplicates += 1
+                    elif result == 'skipped':
+                        stats.skipped += 1
+                except concurrent.futures.CancelledError:
+                    pass
+                except Exception as err:
+                    logger.error('Unable to import %s: %s' % (src, err))
+                    stats.failed += 1
+                if self.isCanceled():
+                    for pending in futures:
+                        pending.cancel()
+                if progress:
+                    progress( stats )
+
+        if not self.isCanceled() and not stats.failed:
+            self.journal.remove()
+        if self.index:
+            self.index.commit()
+        return done, stats
+
+    def _destinationSizes( self, sizes ):
+        '''
+        Returns {size: {partial hash: [(path, stat)]}} of the files in the
+        day folders of the destination with one of sizes, so each source is
+        looked up instead of compared with every file of its size.
+        '''
+        files = []
+        try:
+            with os.scandir( self.folder ) as it:
+                subdirs = [entry.path for entry in it if entry.is_dir()]
+        except OSError as err:
+            logger.error(err)
+            return {}
+        for subdir in subdirs:
+            try:
+                with os.scandir( subdir ) as it:
+                    for entry in it:
+                        if entry.is_file() and not entry.name.endswith('.part'):
+                            st = entry.stat()
+                            if st.st_size in sizes:
+                                files.append( (entry.path, st) )
+            except OSError as err:
+                logger.error(err)
+
+        def partial( file ):
+            try:
+                return self.hashes.partial( *file )
+            except OSError as err:
+                logger.error(err)
+                return None
+
+        index = {}
+        with concurrent.futures.ThreadPoolExecutor( self.workers ) as executor:
+            for file, digest in zip( files, executor.map( partial, files ) ):
+                if digest is not None:
+                    index.setdefault( file[1].st_size, {} ).setdefault( digest, [] ).append( file )
+        return index
+
+    def findDuplicate( self, src, st ):
+        '''
+        Returns the path of a file in the destination with the content of
+        src, or None. The full hash is only read when the size and partial
+        hash already match.
+        '''
+        partials = self._sizes.get( st.st_size )
+        if not partials:
+            return None
+        candidates = partials.get( self.hashes.partial( src, st ) )
+        if not candidates:
+            return None
+        if st.st_size <= PARTIAL_HASH_SIZE * 2:
+            # the partial hash covered the whole file
+            return candidates[0][0]
+        digest = self.hashes.full( src, st )
+        for path, dst_st in candidates:
+            try:
+                if self.hashes.full( path, dst_st ) == digest:
+                    return path
+            except OSError as err:
+                logger.error(err)
+        return None
+
+    def _isJournaled( self, record, src, st, dst ):
+        if record.get('src') != src or record.get('size') != st.st_size or record.get('mtime') != st.st_mtime_ns:
+            return False
+        try:
+            return os.path.getsize( dst ) == st.st_size
+        except OSError:
+            return False
+
+    def _import( self, action, src, rel_path, dst, st ):
+        if self.isCanceled():
+            return None
+        if self.dedupe:
+            duplicate = self.findDuplicate( src, st )
+            if duplicate:
+                logger.debug('Already imported as %s: %s' % (duplicate, src))
+                # kept, so rel_path still shows as imported after a reload
+                self.duplicates.append( { 'path' : rel_path,
+                                          'src' : src,
+                                          'existing' : os.path.relpath( duplicate, self.folder ) } )
+                return 'duplicate'
+        if action != 'replace' and os.path.exists( dst ):
+            return 'skipped'
+
+        folder = os.path.dirname( dst )
+        if not os.path.exists( folder ):
+            os.makedirs( folder, exist_ok=True )
+        logger.debug('Copying from %s to %s' % (src, dst))
+        digest = copyFile( src, dst, self.buffer_size, self.verify )
+        if digest:
+            self.hashes.setFull( dst, os.stat( dst ), digest )
+        self.journal.append( { 'path' : rel_path,
+                               'src' : src,
+                               'size' : st.st_size,
+                               'mtime' : st.st_mtime_ns,
+                               'hash' : digest } )
+        return 'copied'
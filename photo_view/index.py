@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import threading
+import datetime
+
+from .item import PV_ImageInfo
+from . import config
+from . import pathutil
+from .logger import logger
+
+
+class PV_MetadataIndex( object ):
+    '''
+    Persistent cache of the EXIF fields the tree needs, and of the content
+    hashes used to find duplicates on import, keyed by path and validated
+    against the file size and mtime.
+    '''
+    VERSION = 1
+    FIELDS = PV_ImageInfo.__slots__
+
+    def __init__( self, path ):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_hashes = []
+        logger.info('Opening metadata index: %s' % path )
+        self._conn = sqlite3.connect( path, check_same_thread=False )
+        self._createTables()
+
+    def _createTables( self ):
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != self.VERSION:
+            logger.info('Rebuilding metadata index (version %d -> %d)' % (version, self.VERSION))
+            self._conn.execute('DROP TABLE IF EXISTS images')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS images ('
+                           ' path TEXT PRIMARY KEY,'
+                           ' size INTEGER,'
+                           ' mtime INTEGER,'
+                           ' datetime TEXT,'
+                           ' orientation INTEGER,'
+                           ' sequence_number INTEGER,'
+                           ' width INTEGER,'
+                           ' height INTEGER,'
+                           ' preview_width INTEGER,'
+                           ' preview_height INTEGER )')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS hashes ('
+                           ' path TEXT PRIMARY KEY,'
+                           ' size INTEGER,'
+                           ' mtime INTEGER,'
+                           ' partial TEXT,'
+                           ' full TEXT )')
+        self._conn.execute('PRAGMA user_version = %d' % self.VERSION)
+        self._conn.commit()
+
+    def lookup( self, path, stat=None ):
+        '''
+        Returns the cached PV_ImageInfo of path, or None when the file is
+        unknown or has changed since it was indexed.
+        '''
+        if stat is None:
+            stat = os.stat( path )
+        with self._lock:
+            row = self._conn.execute('SELECT %s FROM images WHERE path = ?' % ', '.join(self.FIELDS),
+                                     (path,) ).fetchone()
+        if not row:
+            return None
+        info = PV_ImageInfo( *row )
+        if info.size != stat.st_size or info.mtime != stat.st_mtime_ns:
+            return None
+        info.datetime = datetime.datetime.fromisoformat( info.datetime )
+        return info
+
+    def store( self, path, info ):
+        values = [getattr(info, field) for field in self.FIELDS]
+        values[self.FIELDS.index('datetime')] = info.datetime.isoformat()
+        with self._lock:
+            self._pending.append( [path] + values )
+
+    def lookupHashes( self, path, stat ):
+        '''
+        Returns the (partial, full) hashes stored for path, either can be
+        None, or None when the file has changed since.
+        '''
+        with self._lock:
+            row = self._conn.execute('SELECT size, mtime, partial, full FROM hashes WHERE path = ?',
+                                     (path,) ).fetchone()
+        if not row or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return row[2], row[3]
+
+    def storeHashes( self, path, stat, partial, full ):
+        with self._lock:
+            self._pending_hashes.append( (path, stat.st_size, stat.st_mtime_ns, partial, full) )
+
+    def commit( self ):
+        with self._lock:
+            if not self._pending and not self._pending_hashes:
+                return
+            logger.debug('Writing %d records to metadata index' % (len(self._pending) + len(self._pending_hashes)))
+            self._conn.executemany('INSERT OR REPLACE INTO images VALUES (%s)' % ', '.join(['?']*(len(self.FIELDS)+1)),
+                                   self._pending )
+            self._conn.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)', self._pending_hashes )
+            self._conn.commit()
+            self._pending = []
+            self._pending_hashes = []
+
+    def close( self ):
+        self.commit()
+        self._conn.close()
+
+
+def openMetadataIndex():
+    '''
+    Opens the index configured by 'metadata_index', or returns None when
+    the index is disabled.
+    '''
+    path = config.data.get('metadata_index')
+    if not path:
+        return None
+    path = pathutil.resolvePackagePath( path )
+    try:
+        return PV_MetadataIndex( path )
+    except sqlite3.Error as err:
+        logger.error('Unable to open metadata index %s: %s' % (path, err))
+        return None
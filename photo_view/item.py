@@ -2,30 +2,104 @@ import pyexiv2
 import os
 import re
 import datetime
+import bisect
+import concurrent.futures
 from . import config
 from . import pathutil
+from .logger import logger
+from .movie import readMovieHeader
+from .importer import findDuplicates
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class PV_BaseItem( object ):
-    
+    __slots__ = ( '_data', '_children', '_child_set', '_keys', '_parent', '_row', 'checked' )
+
     def __init__( self, data ):
         self._data = data
         self._children = []
+        self._child_set = set()
+        self._keys = []
         self._parent = None
+        self._row = 0
 
     def removeChild( self, item ):
-        if item in self._children:
-            self._children.remove(item)
+        if item in self._child_set:
+            row = item._row
+            del self._children[row]
+            del self._keys[row]
+            self._child_set.discard( item )
+            self._updateRows( row )
             return True
         return False
 
+    def removeChildren( self, items ):
+        items = set( [item for item in items if item in self._child_set] )
+        if not items:
+            return 0
+        start = min( [item._row for item in items] )
+        children = self._children[start:]
+        keys = self._keys[start:]
+        del self._children[start:]
+        del self._keys[start:]
+        for child, key in zip( children, keys ):
+            if child not in items:
+                self._children.append( child )
+                self._keys.append( key )
+        self._child_set -= items
+        self._updateRows( start )
+        return len(items)
+
     def addChild( self, item ):
         self._checkItem( item )
-        if item not in self._children:
-            self._children.append( item )
         if item.parent and item.parent != self:
             item.parent.removeChild( item )
         item._parent = self
-        self._children.sort( key=lambda a: a.datetime )
+        if item in self._child_set:
+            return
+        # children stay sorted by datetime, after any child with the same key
+        key = item.datetime
+        row = bisect.bisect_right( self._keys, key )
+        self._children.insert( row, item )
+        self._keys.insert( row, key )
+        self._child_set.add( item )
+        self._updateRows( row )
+
+    def addChildren( self, items ):
+        '''
+        Adds items with a single sort, keeping the same order as calling
+        addChild for each of them.
+        '''
+        new = []
+        old_parents = {}
+        for item in items:
+            self._checkItem( item )
+            if item in self._child_set:
+                continue
+            self._child_set.add( item )
+            new.append( item )
+            if item.parent and item.parent != self:
+                old_parents.setdefault( item.parent, [] ).append( item )
+            item._parent = self
+        for parent, children in old_parents.items():
+            parent.removeChildren( children )
+        if not new:
+            return
+
+        pairs = list( zip( self._keys, self._children ) )
+        pairs.extend( [(item.datetime, item) for item in new] )
+        pairs.sort( key=lambda pair: pair[0] )
+        self._keys = [key for key, child in pairs]
+        self._children = [child for key, child in pairs]
+        self._updateRows()
+
+    def _updateRows( self, start=0 ):
+        children = self._children
+        for row in range( start, len(children) ):
+            children[row]._row = row
 
     def _checkItem( self, item ):
         pass
@@ -34,6 +108,13 @@ class PV_BaseItem( object ):
     def parent( self ):
         return self._parent
 
+    @property
+    def row( self ):
+        '''
+        Position of the item in its parent's children.
+        '''
+        return self._row
+
     @property
     def children( self ):
         return self._children
@@ -76,6 +157,7 @@ class PV_BaseItem( object ):
 
 
 class PV_RootItem( PV_BaseItem ):
+    __slots__ = ()
     IMG = pathutil.resolvePackagePath( config.data['folder_icon'] )
     
     def __init__( self, path ):
@@ -92,7 +174,15 @@ class PV_RootItem( PV_BaseItem ):
         return self.IMG
 
 
+class PV_MovieRootItem( PV_RootItem ):
+    '''
+    Root of 'movie_root_dirs', holding movies grouped by day.
+    '''
+    __slots__ = ()
+
+
 class PV_DateGroupItem( PV_BaseItem ):
+    __slots__ = ()
     IMG = pathutil.resolvePackagePath( config.data['continuous_shoot_icon'] )
     
     def __init__( self, data ):
@@ -118,6 +208,8 @@ class PV_DateGroupItem( PV_BaseItem ):
 
 
 class PV_ContinuousShootGroupItem( PV_BaseItem ):
+    __slots__ = ()
+
     def __init__( self, data ):
         super( PV_ContinuousShootGroupItem, self ).__init__( data )
         if not isinstance(self._data, datetime.datetime):
@@ -140,20 +232,91 @@ class PV_ContinuousShootGroupItem( PV_BaseItem ):
         return ''
 
 
+class PV_ImageInfo( object ):
+    '''
+    The EXIF fields used by the tree, kept per item instead of the full
+    pyexiv2.ImageMetadata.
+    '''
+    __slots__ = ( 'size',
+                  'mtime',
+                  'datetime',
+                  'orientation',
+                  'sequence_number',
+                  'width',
+                  'height',
+                  'preview_width',
+                  'preview_height' )
+
+    def __init__( self, size, mtime, datetime, orientation=1, sequence_number=-1,
+                  width=0, height=0, preview_width=0, preview_height=0 ):
+        self.size = size
+        self.mtime = mtime
+        self.datetime = datetime
+        self.orientation = orientation
+        self.sequence_number = sequence_number
+        self.width = width
+        self.height = height
+        self.preview_width = preview_width
+        self.preview_height = preview_height
+
+
 class PV_ImageItem( PV_BaseItem ):
-    def __init__( self, path ):
+    __slots__ = ( '_info', )
+    SEQUENCE_NUMBER_TAG = None
+    PREVIEW_IS_FILE = False
+
+    def __init__( self, path, info=None ):
         super( PV_ImageItem, self ).__init__( path )
-        self.md = pyexiv2.ImageMetadata( path )
-        self.md.read()
+        self._info = info
+        if self._info is None:
+            self._info = self._readInfo()
 
     def addChild( self, item ):
         raise RuntimeError('Unable to add child on ImageItem' )
 
+    def addChildren( self, items ):
+        raise RuntimeError('Unable to add child on ImageItem' )
+
+    def openMetadata( self ):
+        '''
+        Reads the full metadata from the file. It is not kept on the item,
+        so the preview buffers are released once the caller is done.
+        '''
+        md = pyexiv2.ImageMetadata( self._data )
+        md.read()
+        return md
+
+    def _readInfo( self ):
+        md = self.openMetadata()
+        stat = os.stat( self._data )
+        if 'Exif.Photo.DateTimeOriginal' in md:
+            value = md.get('Exif.Photo.DateTimeOriginal').value
+        else:
+            value = md.get('Exif.Image.DateTime').value
+        orientation = md.get('Exif.Image.Orientation')
+        sequence_number = md.get(self.SEQUENCE_NUMBER_TAG) if self.SEQUENCE_NUMBER_TAG else None
+        width, height = md.dimensions
+        preview_width, preview_height = self._getPreviewSize( md )
+        return PV_ImageInfo( stat.st_size,
+                             stat.st_mtime_ns,
+                             value,
+                             orientation.value if orientation else 1,
+                             sequence_number.value if sequence_number else -1,
+                             width,
+                             height,
+                             preview_width,
+                             preview_height )
+
+    def _getPreviewSize( self, md ):
+        return md.dimensions
+
+    @property
+    def info( self ):
+        return self._info
+
     @property
     def datetime( self ):
-        if 'Exif.Photo.DateTimeOriginal' in self.md:
-            return self.md.get('Exif.Photo.DateTimeOriginal').value
-        return self.md.get('Exif.Image.DateTime').value
+        return self._info.datetime
 
     @property
     def name( self ):
@@ -161,11 +324,19 @@ class PV_ImageItem( PV_BaseItem ):
 
     @property
     def thumbnail( self ):
-        return self.md.previews[0].data
+        return self.openMetadata().previews[0].data
+
+    @property
+    def preview_size( self ):
+        return (self._info.preview_width, self._info.preview_height)
 
     @property
     def orientation( self ):
-        return self.md.get('Exif.Image.Orientation').value
+        return self._info.orientation
+
+    @property
+    def sequence_number( self ):
+        return self._info.sequence_number
 
     @property
     def path( self ):
@@ -177,42 +348,79 @@ class PV_ImageItem( PV_BaseItem ):
 
 
 class PV_JPG( PV_ImageItem ):
+    __slots__ = ()
+    SEQUENCE_NUMBER_TAG = 'Exif.Sony1.SequenceNumber'
+    PREVIEW_IS_FILE = True
 
     @property
     def preview( self ):
-        return self.md.buffer
+        with open( self._data, 'rb' ) as fp:
+            return fp.read()
 
-    @property
-    def preview_size( self ):
-        return self.md.dimensions
+class PV_ARW( PV_ImageItem ):
+    __slots__ = ()
+    SEQUENCE_NUMBER_TAG = 'Exif.Sony2.SequenceNumber'
+
+    def _getPreviewSize( self, md ):
+        return md.previews[1].dimensions
 
     @property
-    def sequence_number( self ):
-        tag = self.md.get('Exif.Sony1.SequenceNumber')
-        if tag:
-            return tag.value
-        return -1
+    def preview( self ):
+        return self.openMetadata().previews[1].data
 
-class PV_ARW( PV_ImageItem ):
+class PV_MovieInfo( object ):
+    '''
+    The fields of a movie read from its mvhd atom.
+    '''
+    __slots__ = ( 'size',
+                  'mtime',
+                  'datetime',
+                  'duration' )
+
+    def __init__( self, size, mtime, datetime, duration=0.0 ):
+        self.size = size
+        self.mtime = mtime
+        self.datetime = datetime
+        self.duration = duration
+
+
+class PV_MovieItem( PV_BaseItem ):
+    __slots__ = ( '_info', )
+
+    def __init__( self, path, info=None ):
+        super( PV_MovieItem, self ).__init__( path )
+        self._info = info
+        if self._info is None:
+            self._info = readMovieInfo( path )
+
+    def addChild( self, item ):
+        raise RuntimeError('Cannot add child to a movie')
+
+    def addChildren( self, items ):
+        raise RuntimeError('Cannot add child to a movie')
 
     @property
-    def preview( self ):
-        return self.md.previews[1].data
+    def info( self ):
+        return self._info
 
     @property
-    def preview_size( self ):
-        return self.md.previews[1].dimensions
+    def datetime( self ):
+        return self._info.datetime
 
     @property
-    def sequence_number( self ):
-        tag = self.md.get('Exif.Sony2.SequenceNumber')
-        if tag:
-            return tag.value
-        return -1
+    def duration( self ):
+        return self._info.duration
 
-class PV_MovieItem( PV_BaseItem ):
-    def __init__( self, path ):
-        super( PV_MovieItem, self ).__init__( path )
+    @property
+    def name( self ):
+        return os.path.basename( self._data )
+
+    @property
+    def path( self ):
+        path = self.name
+        if self.parent:
+            path = self.parent.path + '/' + self.name
+        return path
 
 
 
@@ -221,39 +429,260 @@ IMAGE_MAPPING = {'.jpg' : PV_JPG,
                  '.arw' : PV_ARW }
 #===================================================
 
-def findImages( root_dir=None ):
-    if root_dir:
-        root_dirs=[root_dir]
-    else:
+# staging folder of deleted images inside each root, never scanned
+TRASH_FOLDER = config.data.get('delete_trash_folder') or ''
+
+def getImageSuffixes():
+    return set( ['.' + ext.lower() for ext in config.data['image_extensions']] )
+
+def scanImages( root_dirs=None, suffixes=None, dirs=None ):
+    '''
+    Yields an os.DirEntry for each image under root_dirs, in sorted path
+    order. The entries keep their stat result for the metadata index.
+    Scanned directories are appended to dirs when it is given.
+    '''
+    if root_dirs is None:
         root_dirs = config.data['image_root_dirs']
+    if suffixes is None:
+        suffixes = getImageSuffixes()
+    for root_dir in sorted(root_dirs):
+        yield from _scanDir( root_dir, suffixes, dirs )
+
+def _scanDir( path, suffixes, dirs ):
+    try:
+        with os.scandir( path ) as it:
+            entries = []
+            for entry in it:
+                name = entry.name
+                if entry.is_dir():
+                    # directories sort as 'name/' so the walk matches sorted() of full paths
+                    if not entry.is_symlink() and name != TRASH_FOLDER:
+                        entries.append( (name + '/', entry) )
+                elif name[name.rfind('.'):].lower() in suffixes:
+                    entries.append( (name, entry) )
+    except OSError as err:
+        logger.error(err)
+        return
+    if dirs is not None:
+        dirs.append( path )
+
+    entries.sort( key=lambda pair: pair[0] )
+    for key, entry in entries:
+        if key[-1] == '/':
+            yield from _scanDir( entry.path, suffixes, dirs )
+        else:
+            yield entry
+
+def getMovieSuffixes():
+    return set( ['.' + ext.lower() for ext in config.data.get('movie_extensions') or []] )
 
-    extensions = config.data['image_extensions']
-    extensions_pattern = '(' + '|'.join(extensions) + ')$'
-    images = []
-    for root_dir in root_dirs:
-        for root, dirs, files in os.walk(root_dir):
-            for file in files:
-                if re.search( extensions_pattern, file ):
-                    path = os.path.join(root, file)
-                    images.append( path )
-    return sorted(images)
-
-def getImageItem( image ):
+def findImages( root_dir=None ):
+    root_dirs = None
+    if root_dir:
+        root_dirs = [root_dir]
+    return [entry.path for entry in scanImages( root_dirs )]
+
+def findImported( folder ):
+    '''
+    Returns the set of 'YYYY-MM-DD/name' paths already present in an import
+    destination, matching PV_ImageItem.path, and those skipped on import
+    as duplicates of a file there.
+    '''
+    paths = set()
+    try:
+        with os.scandir( folder ) as it:
+            subdirs = [entry for entry in it if entry.is_dir()]
+    except OSError as err:
+        logger.error(err)
+        return paths
+    for subdir in subdirs:
+        try:
+            with os.scandir( subdir.path ) as it:
+                paths.update( [subdir.name + '/' + entry.name for entry in it if not entry.is_dir()] )
+        except OSError as err:
+            logger.error(err)
+    paths.update( findDuplicates( folder ) )
+    return paths
+
+def getImageItem( image, index=None ):
+    stat = None
+    if isinstance( image, os.DirEntry ):
+        stat = image.stat()
+        image = image.path
     ext = os.path.splitext( image )[-1]
     cls = IMAGE_MAPPING.get(ext.lower()) or PV_ImageItem
-    return cls(image)
-
+    if not index:
+        return cls(image)
+
+    info = index.lookup( image, stat )
+    if info:
+        return cls(image, info)
+    item = cls(image)
+    index.store( image, item.info )
+    return item
+
+def _getImageItemOrNone( image, index ):
+    try:
+        return getImageItem( image, index )
+    except Exception as err:
+        logger.error(err)
+    return None
+
+def getImageItems( images, index=None, workers=None ):
+    '''
+    Returns the items of images (paths or os.DirEntry) in the same order,
+    skipping files that fail to load. Metadata is read by
+    'metadata_workers' threads, in batches of 'metadata_batch_size' files.
+    '''
+    if workers is None:
+        workers = config.data.get('metadata_workers') or 1
+    batch_size = config.data.get('metadata_batch_size') or 256
+
+    if workers <= 1:
+        items = [_getImageItemOrNone( image, index ) for image in images]
+        return [item for item in items if item]
+
+    items = []
+    with concurrent.futures.ThreadPoolExecutor( max_workers=workers ) as executor:
+        for start in range( 0, len(images), batch_size ):
+            batch = images[start:start+batch_size]
+            results = executor.map( _getImageItemOrNone, batch, [index]*len(batch) )
+            items.extend( [item for item in results if item] )
+    return items
+
+
+def readMovieInfo( path, stat=None ):
+    '''
+    Reads the creation time and duration of a movie from its headers. The
+    creation time is stored in UTC and returned in local time; movies
+    without one use the file mtime.
+    '''
+    if stat is None:
+        stat = os.stat( path )
+    created, duration = readMovieHeader( path )
+    if created:
+        created = created.replace( tzinfo=datetime.timezone.utc ).astimezone().replace( tzinfo=None )
+    else:
+        created = datetime.datetime.fromtimestamp( stat.st_mtime )
+    return PV_MovieInfo( stat.st_size, stat.st_mtime_ns, created, duration )
+
+def getMovieItem( movie ):
+    stat = None
+    if isinstance( movie, os.DirEntry ):
+        stat = movie.stat()
+        movie = movie.path
+    return PV_MovieItem( movie, readMovieInfo( movie, stat ) )
+
+def _getMovieItemOrNone( movie ):
+    try:
+        return getMovieItem( movie )
+    except Exception as err:
+        logger.error('%s: %s' % (getattr(movie, 'path', movie), err))
+    return None
+
+def getMovieItems( movies, workers=None ):
+    '''
+    Returns the items of movies (paths or os.DirEntry) in the same order,
+    skipping files without a readable movie header.
+    '''
+    if workers is None:
+        workers = config.data.get('metadata_workers') or 1
+    if workers <= 1:
+        items = [_getMovieItemOrNone( movie ) for movie in movies]
+    else:
+        with concurrent.futures.ThreadPoolExecutor( max_workers=workers ) as executor:
+            items = list( executor.map( _getMovieItemOrNone, movies ) )
+    return [item for item in items if item]
+
+
+def loadImages( root_dir, index=None, workers=None, dirs=None, progress=None, canceled=None, loaded=None ):
+    '''
+    Scans root_dir and returns its image items. Items are built in batches
+    of 'metadata_batch_size' files per worker while the scan is still
+    walking the tree. progress is called with the number of files read
+    so far, and loaded with the items of each batch; canceled is polled
+    between batches, and None is returned once it is true.
+    '''
+    if workers is None:
+        workers = config.data.get('metadata_workers') or 1
+    batch_size = (config.data.get('metadata_batch_size') or 256) * workers
+    items = []
+    batch = []
+    done = 0
+    for entry in scanImages( [root_dir], dirs=dirs ):
+        batch.append( entry )
+        if len(batch) < batch_size:
+            continue
+        if canceled and canceled():
+            return None
+        batch_items = getImageItems( batch, index, workers )
+        items.extend( batch_items )
+        done += len(batch)
+        batch = []
+        if progress:
+            progress( done )
+        if loaded:
+            loaded( batch_items )
+    if canceled and canceled():
+        return None
+    batch_items = getImageItems( batch, index, workers )
+    items.extend( batch_items )
+    done += len(batch)
+    if progress:
+        progress( done )
+    if loaded and batch_items:
+        loaded( batch_items )
+    return items
+
+def loadMovies( root_dir, workers=None ):
+    return getMovieItems( list( scanImages( [root_dir], getMovieSuffixes() ) ), workers )
+
+def groupImages( items ):
+    '''
+    Builds the date groups of items, and the continuous shoot groups in
+    each of them, as shown under a root of the tree. Days are grouped
+    apart, like regroupDay() does, so a root loaded in batches gets the
+    same tree.
+    '''
+    dates = groupImagesByDay( items )
+    for date in dates:
+        groupImagesByContinuousShooting( sorted( date.children, key=lambda image: image.data ) )
+    return dates
 
 def groupImagesByDay( image_items ):
     groups = {}
+    images = {}
     for image in image_items:
         value = image.datetime.date().isoformat()
         if value not in groups:
             groups[value] = PV_DateGroupItem( value )
-        group = groups[value]
-        group.addChild( image )
+            images[value] = []
+        images[value].append( image )
+    for value, group in groups.items():
+        group.addChildren( images[value] )
     return sorted(groups.values(), key=lambda group: group.datetime)
 
+def regroupDay( group, images ):
+    '''
+    Replaces the children of a date group with images and rebuilds its
+    continuous shoot groups.
+    '''
+    children = list(group.children)
+    group.removeChildren( children )
+    for child in children:
+        child._parent = None
+    images = sorted( images, key=lambda image: image.data )
+    group.addChildren( images )
+    groupImagesByContinuousShooting( images )
+    return group
+
+def iterImages( node ):
+    for child in node.children:
+        if isinstance( child, PV_ImageItem ):
+            yield child
+        else:
+            yield from iterImages( child )
+
 def isContinuousShooting( a, b ):
     if not isinstance( a, PV_ImageItem ) or not isinstance( b, PV_ImageItem ):
         return False
@@ -275,37 +704,118 @@ def isContinuousShooting( a, b ):
     return a.sequence_number != b.sequence_number
             
     
-def groupImagesByContinuousShooting( images ):
-#    threshold = int(config.data.get('continuous_shoot_threshold_sec')) or 1
-    groups = []
-
-    prev_image = None
-    curr_group = None
-    
-    for curr_image in images:
-        if not prev_image:
-            prev_image = curr_image
+_NUMBER_RE = re.compile('[0-9]+')
+_MICROSECOND = datetime.timedelta( microseconds=1 )
+
+def getShootingColumns( images ):
+    '''
+    Returns the columns isContinuousShooting() looks at, one entry per
+    image: whether it is an image, the first number in its name (None
+    without one), its datetime in microseconds and its sequence number.
+    '''
+    is_image = []
+    numbers = []
+    times = []
+    sequences = []
+    base = None
+    for image in images:
+        if not isinstance( image, PV_ImageItem ):
+            is_image.append( False )
+            numbers.append( None )
+            times.append( 0 )
+            sequences.append( 0 )
             continue
+        m = _NUMBER_RE.search( image.name )
+        info = image.info
+        if base is None:
+            base = info.datetime
+        is_image.append( True )
+        numbers.append( int(m.group()) if m else None )
+        times.append( (info.datetime - base) // _MICROSECOND )
+        sequences.append( info.sequence_number )
+    return is_image, numbers, times, sequences
+
+def _continuousFlags( columns, threshold ):
+    is_image, numbers, times, sequences = columns
+    flags = []
+    for i in range( 1, len(is_image) ):
+        if not (is_image[i-1] and is_image[i]):
+            flags.append( False )
+        elif numbers[i-1] is not None and numbers[i] is not None and numbers[i] - numbers[i-1] == 1:
+            flags.append( sequences[i] - sequences[i-1] == 1 )
+        else:
+            # timedelta.seconds: whole seconds, wrapped to a day
+            seconds = ((times[i] - times[i-1]) // 1000000) % 86400
+            flags.append( seconds <= threshold and sequences[i-1] != sequences[i] )
+    return flags
+
+def _continuousFlagsNumpy( columns, threshold ):
+    is_image, numbers, times, sequences = columns
+    is_image = numpy.array( is_image, dtype=bool )
+    has_number = numpy.array( [number is not None for number in numbers], dtype=bool )
+    numbers = [number or 0 for number in numbers]
+    # long digit runs in names would overflow int64
+    numbers = numpy.array( numbers, dtype=numpy.int64 if max( numbers ) < 2**62 else object )
+    times = numpy.array( times, dtype=numpy.int64 )
+    sequences = numpy.array( sequences, dtype=numpy.int64 )
+
+    named = has_number[:-1] & has_number[1:] & (numpy.diff( numbers ) == 1)
+    seconds = numpy.floor_divide( numpy.diff( times ), 1000000 ) % 86400
+    timed = (seconds <= threshold) & (sequences[:-1] != sequences[1:])
+    flags = numpy.where( named, numpy.diff( sequences ) == 1, timed )
+    return (flags & is_image[:-1] & is_image[1:]).tolist()
+
+def getContinuousShootingFlags( images, threshold=None ):
+    '''
+    Returns isContinuousShooting() for every pair of neighbouring images,
+    computed on columns extracted once, with NumPy when it is installed.
+    '''
+    if threshold is None:
+        threshold = int(config.data.get('continuous_shoot_threshold_sec')) or 1
+    columns = getShootingColumns( images )
+    if len(columns[0]) < 2:
+        return []
+    if numpy is not None:
+        return _continuousFlagsNumpy( columns, threshold )
+    return _continuousFlags( columns, threshold )
 
-        #if abs(prev_image.datetime - curr_image.datetime).seconds < threshold:
-        if isContinuousShooting( prev_image, curr_image ):
-            if not curr_group:
-                curr_group = PV_ContinuousShootGroupItem( prev_image.datetime )
-                groups.append( curr_group )
-                
-            if prev_image.parent:
-                prev_image.parent.addChild( curr_group )
-            if curr_image.parent:
-                curr_image.parent.addChild( curr_group )
-            curr_group.addChild( prev_image )
-            curr_group.addChild( curr_image )
-
-        elif curr_group:
-            curr_group = None
+def groupImagesByContinuousShooting( images ):
+    images = list(images)
+    runs = []
+    run = None
+    for i, flag in enumerate( getContinuousShootingFlags( images ) ):
+        if flag:
+            if not run:
+                run = [images[i]]
+                runs.append( run )
+            run.append( images[i+1] )
+        else:
+            run = None
 
-            
-        prev_image = curr_image
-        
+    groups = []
+    removed = {}
+    added = {}
+    for run in runs:
+        group = PV_ContinuousShootGroupItem( run[0].datetime )
+        # the group goes to the parent of the last image, like the images
+        # were added pair by pair
+        parents = [image.parent for image in run if image.parent]
+        if parents:
+            added.setdefault( parents[-1], [] ).append( group )
+        for image in run:
+            if image.parent:
+                removed.setdefault( image.parent, [] ).append( image )
+        groups.append( group )
+
+    # one pass over the children of each parent, not one per group
+    for parent, images in removed.items():
+        parent.removeChildren( images )
+        for image in images:
+            image._parent = None
+    for parent, parent_groups in added.items():
+        parent.addChildren( parent_groups )
+    for group, run in zip( groups, runs ):
+        group.addChildren( run )
     return groups
     
 def test_populateItems():
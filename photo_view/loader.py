@@ -0,0 +1,171 @@
+from PySide6 import QtCore
+
+from .item import *
+from . import config
+from .logger import logger
+
+import os
+
+
+class PV_Loader( QtCore.QObject ):
+    '''
+    Scans the root nodes and builds their date groups on a worker thread.
+    The groups are handed back through rootLoaded while a root is still
+    being scanned, a batch of images at a time, so the tree fills in as
+    results arrive. A day found in several batches comes in several
+    groups, which the model merges.
+    '''
+    progress = QtCore.Signal( int, int )
+    rootScanned = QtCore.Signal( str, object )
+    importedScanned = QtCore.Signal( str, object )
+    rootLoaded = QtCore.Signal( object, object )
+    finished = QtCore.Signal()
+
+    def __init__( self, root_nodes, index=None, import_dest_folder=None ):
+        super( PV_Loader, self ).__init__()
+        self.root_nodes = root_nodes
+        self.index = index
+        self.import_dest_folder = import_dest_folder
+        self._canceled = False
+
+    def cancel( self ):
+        self._canceled = True
+
+    def isCanceled( self ):
+        return self._canceled
+
+    @QtCore.Slot()
+    def run( self ):
+        logger.debug('PV_Loader.run()...')
+        try:
+            self._load()
+        except Exception as err:
+            logger.error(err)
+        finally:
+            if self.index:
+                self.index.commit()
+            self.finished.emit()
+
+    def _load( self ):
+        workers = config.data.get('metadata_workers') or 1
+        self._count = 0
+        self.progress.emit( 0, 0 )
+        if self.import_dest_folder:
+            self.importedScanned.emit( self.import_dest_folder, findImported( self.import_dest_folder ) )
+
+        for root_node in self.root_nodes:
+            if isinstance( root_node, PV_MovieRootItem ):
+                self._loadMovies( root_node, workers )
+                if self._canceled:
+                    return
+                continue
+
+            dirs = []
+            snapshot = {}
+            start = self._count
+            self._pending = []
+            self._emit_size = 0
+            items = loadImages( root_node.data, self.index, workers, dirs,
+                                lambda count: self._progress( start + count ),
+                                self.isCanceled,
+                                lambda batch: self._loaded( root_node, batch ) )
+            if items is None:
+                return
+            self._emitPending( root_node )
+
+            for path in dirs:
+                snapshot[path] = {}
+            for item in items:
+                info = item.info
+                snapshot.setdefault( os.path.dirname(item.data), {} )[item.name] = (info.size, info.mtime)
+            self.rootScanned.emit( root_node.data, snapshot )
+            logger.debug('Loaded %s: %d images' % (root_node.name, len(items)))
+
+    def _progress( self, count ):
+        self._count = count
+        self.progress.emit( count, 0 )
+
+    def _loaded( self, root_node, items ):
+        # the first batch is shown at once, then each emit waits for twice
+        # as many images, which bounds how often a day is regrouped
+        self._pending.extend( items )
+        if len(self._pending) >= self._emit_size:
+            self._emit_size = 2 * len(self._pending)
+            self._emitPending( root_node )
+
+    def _emitPending( self, root_node ):
+        if not self._pending:
+            return
+        dates = groupImages( self._pending )
+        self._pending = []
+        self.rootLoaded.emit( root_node, dates )
+
+    def _loadMovies( self, root_node, workers ):
+        items = loadMovies( root_node.data, workers )
+        if self._canceled:
+            return
+        self._progress( self._count + len(items) )
+        dates = groupImagesByDay( items )
+        logger.debug('Loaded %s: %d movies, %d days' % (root_node.name, len(items), len(dates)))
+        self.rootLoaded.emit( root_node, dates )
+
+
+class PV_ChangeSignals( QtCore.QObject ):
+    finished = QtCore.Signal( int, str, object, object )
+
+
+class PV_ChangeJob( QtCore.QRunnable ):
+    def __init__( self, generation, root_dir, added, removed, index, signals ):
+        super( PV_ChangeJob, self ).__init__()
+        self.generation = generation
+        self.root_dir = root_dir
+        self.added = added
+        self.removed = removed
+        self.index = index
+        self.signals = signals
+
+    def run( self ):
+        items = []
+        try:
+            items = getImageItems( self.added, self.index )
+            if self.index:
+                self.index.commit()
+        except Exception as err:
+            logger.error(err)
+        self.signals.finished.emit( self.generation, self.root_dir, items, self.removed )
+
+
+class PV_ChangeReader( QtCore.QObject ):
+    '''
+    Reads the metadata of the images reported by PV_FileWatcher on a
+    worker thread, one change after the other, and hands the items back
+    through changesRead on the GUI thread.
+    '''
+    changesRead = QtCore.Signal( str, object, object )
+
+    def __init__( self, index=None, parent=None ):
+        super( PV_ChangeReader, self ).__init__( parent )
+        self.index = index
+        self._generation = 0
+        self.pool = QtCore.QThreadPool( self )
+        self.pool.setMaxThreadCount( 1 )
+        self.signals = PV_ChangeSignals( self )
+        self.signals.finished.connect( self._finished )
+
+    def read( self, root_dir, added, removed ):
+        self.pool.start( PV_ChangeJob( self._generation, root_dir, list(added), list(removed),
+                                       self.index, self.signals ) )
+
+    def clear( self ):
+        '''
+        Drops the changes not applied yet, when the tree is reloaded.
+        '''
+        self._generation += 1
+        self.pool.clear()
+
+    def wait( self ):
+        self.pool.waitForDone()
+
+    def _finished( self, generation, root_dir, items, removed ):
+        if generation == self._generation:
+            self.changesRead.emit( root_dir, items, removed )
@@ -1,28 +1,61 @@
 from PySide6 import QtCore
 from PySide6 import QtGui
+from PySide6 import QtWidgets
 
 from .item import *
+from .index import openMetadataIndex
+from .loader import PV_Loader, PV_ChangeReader
+from .watcher import PV_FileWatcher
+from .thumbnail import PV_ThumbnailService
+from .store import openThumbnailStore
 from . import config
 from . import pathutil
+from .cache import pixmap_cache, cacheKey
 from .logger import logger
 
 import os
+import bisect
 
 class PV_Model( QtCore.QAbstractItemModel ):
 
+    # parents with more runs of removed rows have all their rows removed
+    # and the kept ones inserted again, instead of one view update per run
+    REMOVE_RANGE_LIMIT = 32
+
     checkStateChanged = QtCore.Signal( QtCore.QModelIndex )
+    loadProgress = QtCore.Signal( int, int )
+    loadFinished = QtCore.Signal()
     
     def __init__( self, parent = None ):
         super( PV_Model, self ).__init__( parent )
-        self.root_nodes = self._getRootNodes()
-        self._populateNodes()
+        self.metadata_index = openMetadataIndex()
+        self._loaders = []
+        self._image_nodes = {}
+        self._checked = set()
+        self.watcher = PV_FileWatcher( self )
+        self.watcher.setEnabled( bool(config.data.get('watch_image_root_dirs')) )
+        self.change_reader = PV_ChangeReader( self.metadata_index, self )
+        self.watcher.changed.connect( self.change_reader.read )
+        self.change_reader.changesRead.connect( self.applyChanges )
         self.import_dest_folder = config.data.get('image_save_folder') or ''
+        self._imported = set()
+        self.root_nodes = self._getRootNodes()
+        self.load()
 
         icon_img = pathutil.resolvePackagePath( config.data['folder_icon'] )
         self.folder_icon = QtGui.QIcon( icon_img )
         icon_img = pathutil.resolvePackagePath( config.data['continuous_shoot_icon'] )
         self.cs_icon = QtGui.QIcon( icon_img )
 
+        icon_size = config.data.get('icon_size') or 32
+        pm = QtGui.QPixmap( icon_size, icon_size )
+        pm.fill( QtGui.QColor(200, 200, 200) )
+        self.placeholder_icon = QtGui.QIcon( pm )
+        self.movie_icon = QtWidgets.QApplication.style().standardIcon( QtWidgets.QStyle.SP_MediaPlay )
+        self.thumbnail_store = openThumbnailStore()
+        self.thumbnails = PV_ThumbnailService( self.thumbnail_store, self )
+        self.thumbnails.thumbnailReady.connect( self._thumbnailReady )
+
     def rowCount( self, index ):
         if index.isValid():
             return len(index.internalPointer().children)
@@ -50,10 +83,12 @@ class PV_Model( QtCore.QAbstractItemModel ):
         if not index.isValid():
             return QtCore.QModelIndex()
         node = index.internalPointer()
-        if node.parent:
-            return self.createIndex( node.parent.children.index(node), 0, node.parent )
-        else:
+        parent_node = node.parent
+        if not parent_node:
             return QtCore.QModelIndex()
+        if parent_node.parent:
+            return self.createIndex( parent_node.row, 0, parent_node )
+        return self.createIndex( self.root_nodes.index(parent_node), 0, parent_node )
 
     def data( self, index, role = QtCore.Qt.DisplayRole ):
         if not index.isValid():
@@ -63,18 +98,22 @@ class PV_Model( QtCore.QAbstractItemModel ):
         if role == QtCore.Qt.DisplayRole:
             if isinstance(node, PV_ImageItem) and self._isImported(node):
                 return '%s (imported)' % node.name
+            if isinstance(node, PV_MovieItem):
+                minutes, seconds = divmod( int(round(node.duration)), 60 )
+                return '%s (%d:%02d)' % (node.name, minutes, seconds)
             return node.name
 
         elif role == QtCore.Qt.DecorationRole:
             if isinstance(node, PV_ImageItem):
-                pm = QtGui.QPixmap()
-                key = 'icon_' + node.name
-                if not QtGui.QPixmapCache.find( key, pm ):
-                    pm.loadFromData( node.thumbnail )
-                    QtGui.QPixmapCache.insert( key, pm )
+                pm = pixmap_cache.find( cacheKey( node, 'icon' ) )
+                if pm is None:
+                    self.thumbnails.request( node )
+                    return self.placeholder_icon
                 return QtGui.QIcon(pm)
             elif isinstance(node, PV_ContinuousShootGroupItem ):
                 return self.cs_icon
+            elif isinstance(node, PV_MovieItem ):
+                return self.movie_icon
             return self.folder_icon
         elif role == QtCore.Qt.ForegroundRole:
             if isinstance(node, PV_ImageItem) and self._isImported(node):
@@ -87,20 +126,230 @@ class PV_Model( QtCore.QAbstractItemModel ):
 
         elif role == QtCore.Qt.CheckStateRole:
             if node not in self.root_nodes:
-                if getattr(node, 'checked', 0):
-                    return QtCore.Qt.Checked
-                return QtCore.Qt.Unchecked
+                return getattr(node, 'checked', QtCore.Qt.Unchecked)
         
+    def indexFromNode( self, node ):
+        '''
+        Returns the index of node, or an invalid index when the node is no
+        longer part of the tree.
+        '''
+        child = node
+        while child.parent:
+            parent = child.parent
+            if child.row >= len(parent.children) or parent.children[child.row] is not child:
+                return QtCore.QModelIndex()
+            child = parent
+        if child not in self.root_nodes:
+            return QtCore.QModelIndex()
+        if node is child:
+            return self.createIndex( self.root_nodes.index(node), 0, node )
+        return self.createIndex( node.row, 0, node )
+
+    def _thumbnailReady( self, node, pm ):
+        pixmap_cache.insert( cacheKey( node, 'icon' ), pm )
+        index = self.indexFromNode( node )
+        if index.isValid():
+            self.dataChanged.emit( index, index, [QtCore.Qt.DecorationRole] )
+
     def headerData( self, section, orientation, role=QtCore.Qt.DisplayRole ):
         if section == 0 and role == QtCore.Qt.Orientation:
             return 'Name'
         return None
 
     def reset( self ):
+        self.cancelLoading()
+        self.thumbnails.clear()
+        self.watcher.clear()
+        self.change_reader.clear()
         self.beginResetModel()
         self.root_nodes = self._getRootNodes()
-        self._populateNodes()
+        self._image_nodes = {}
+        self._checked = set()
         self.endResetModel()
+        self.load()
+
+    def load( self ):
+        '''
+        Starts populating the root nodes on a PV_Loader thread.
+        '''
+        thread = QtCore.QThread( self )
+        loader = PV_Loader( list(self.root_nodes), self.metadata_index, self.import_dest_folder )
+        loader.moveToThread( thread )
+        thread.started.connect( loader.run )
+        loader.progress.connect( self.loadProgress )
+        loader.rootScanned.connect( self._watchRoot )
+        loader.importedScanned.connect( self._setImported )
+        loader.rootLoaded.connect( self._insertDateGroups )
+        loader.finished.connect( self._loaderFinished )
+        loader.finished.connect( thread.quit )
+        thread.finished.connect( self._cleanupLoaders )
+        self._loaders.append( (thread, loader) )
+        thread.start()
+
+    def cancelLoading( self ):
+        for thread, loader in self._loaders:
+            loader.cancel()
+
+    def stopLoading( self ):
+        self.cancelLoading()
+        for thread, loader in self._loaders:
+            thread.quit()
+            thread.wait()
+        self._loaders = []
+
+    def close( self ):
+        self.stopLoading()
+        self.change_reader.wait()
+        self.thumbnails.wait()
+
+    def _loaderFinished( self ):
+        loader = self.sender()
+        if loader and not loader.isCanceled():
+            self.loadFinished.emit()
+
+    def _cleanupLoaders( self ):
+        self._loaders = [(thread, loader) for thread, loader in self._loaders if not thread.isFinished()]
+
+    def _insertDateGroups( self, root_node, groups ):
+        '''
+        Adds date groups loaded for root_node, while the root is still
+        being scanned. A day already in the tree gets the new images and is
+        regrouped; the other groups are inserted as the loader built them.
+        '''
+        if root_node not in self.root_nodes:
+            return
+        existing = dict( [(group.name, group) for group in root_node.children] )
+        new = []
+        for group in groups:
+            images = list( iterImages( group ) )
+            for image in images:
+                self._image_nodes[image.data] = image
+            old = existing.get( group.name )
+            if old:
+                self._regroup( old, list( iterImages( old ) ) + images )
+            else:
+                new.append( group )
+        self._insertGroups( root_node, new )
+
+    def _insertGroups( self, root_node, groups ):
+        '''
+        Inserts new date groups in date order, with one beginInsertRows per
+        run of groups that end up in adjacent rows.
+        '''
+        if not groups:
+            return
+        root_index = self.indexFromNode( root_node )
+        batch_size = config.data.get('load_insert_batch_size') or 100
+        keys = [child.datetime for child in root_node.children]
+        runs = []
+        for group in sorted( groups, key=lambda group: group.datetime ):
+            row = bisect.bisect_right( keys, group.datetime )
+            if runs and runs[-1][0] == row and len(runs[-1][1]) < batch_size:
+                runs[-1][1].append( group )
+            else:
+                runs.append( (row, [group]) )
+        # from the bottom, so the rows of the runs above stay valid
+        for row, run in reversed( runs ):
+            self.beginInsertRows( root_index, row, row+len(run)-1 )
+            root_node.addChildren( run )
+            self.endInsertRows()
+
+    def _watchRoot( self, root_dir, snapshot ):
+        if root_dir in [root_node.data for root_node in self.root_nodes]:
+            self.watcher.watch( root_dir, snapshot )
+
+    def setWatching( self, value ):
+        self.watcher.setEnabled( value )
+
+    def applyChanges( self, root_dir, items, removed ):
+        '''
+        Updates the tree for the image items added and the paths removed
+        under root_dir, as read by PV_ChangeReader. Only the date groups
+        that contain those images are regrouped.
+        '''
+        root_nodes = [node for node in self.root_nodes if node.data == root_dir]
+        if not root_nodes:
+            return
+        root_node = root_nodes[0]
+
+        touched = {}
+        for path in removed:
+            node = self._image_nodes.pop( path, None )
+            if not node or not node.parent:
+                continue
+            self._checked.discard( node )
+            group = node.parent
+            while not isinstance( group, PV_DateGroupItem ):
+                group = group.parent
+            if group.name not in touched:
+                touched[group.name] = set( iterImages( group ) )
+            touched[group.name].discard( node )
+
+        groups = dict( [(group.name, group) for group in root_node.children] )
+        for item in items:
+            if item.data in self._image_nodes:
+                # already in the tree
+                continue
+            name = item.datetime.date().isoformat()
+            if name not in touched:
+                group = groups.get( name )
+                touched[name] = set(iterImages(group)) if group else set()
+            touched[name].add( item )
+            self._image_nodes[item.data] = item
+
+        root_index = self.index( self.root_nodes.index(root_node), 0, QtCore.QModelIndex() )
+        for name, images in sorted(touched.items()):
+            group = groups.get( name )
+            if not group and not images:
+                continue
+            if not group:
+                group = PV_DateGroupItem( name )
+                row = len( [child for child in root_node.children if child.datetime <= group.datetime] )
+                regroupDay( group, images )
+                self.beginInsertRows( root_index, row, row )
+                root_node.addChild( group )
+                self.endInsertRows()
+            elif not images:
+                row = group.row
+                self.beginRemoveRows( root_index, row, row )
+                root_node.removeChild( group )
+                self.endRemoveRows()
+            else:
+                self._regroup( group, images )
+
+    def _regroup( self, group, images ):
+        '''
+        Rebuilds the continuous shoot groups of a date group with images:
+        its rows are removed, then the new ones inserted.
+        '''
+        group_index = self.indexFromNode( group )
+        children = list( group.children )
+        if children:
+            self.beginRemoveRows( group_index, 0, len(children)-1 )
+            group.removeChildren( children )
+            for child in children:
+                child._parent = None
+            self.endRemoveRows()
+
+        # grouped apart, then moved in once the rows are announced
+        staging = regroupDay( PV_DateGroupItem( group.name ), images )
+        children = list( staging.children )
+        for child in children:
+            if child.children:
+                self.setChecked( child, self._childrenState( child ) )
+        if children:
+            self.beginInsertRows( group_index, 0, len(children)-1 )
+            group.addChildren( children )
+            self.endInsertRows()
+
+        changed = {}
+        self._updateParentStates( [group], changed )
+        self._emitCheckChanges( changed )
+
+    def _iterNodes( self, node ):
+        for child in node.children:
+            yield child
+            yield from self._iterNodes( child )
 
     def flags( self, index ):
         if index.isValid():
@@ -114,46 +363,167 @@ class PV_Model( QtCore.QAbstractItemModel ):
 
         node = index.internalPointer()
         if role == QtCore.Qt.CheckStateRole:
-            if getattr(node, 'checked', 0) != value:
-                node.checked = value
-                self.dataChanged.emit(index, index)
+            value = QtCore.Qt.CheckState( value )
+            if getattr(node, 'checked', QtCore.Qt.Unchecked) != value:
+                self.setCheckState( [node], value )
                 self.checkStateChanged.emit(index)
             return True
         return False
 
+    def setChecked( self, node, value ):
+        '''
+        Sets the check state of node without notifying the views, keeping
+        the set of checked nodes up to date.
+        '''
+        value = QtCore.Qt.CheckState( value )
+        node.checked = value
+        if value == QtCore.Qt.Checked:
+            self._checked.add( node )
+        else:
+            self._checked.discard( node )
+
+    def setCheckState( self, nodes, value ):
+        '''
+        Sets nodes and everything below them to value, and their ancestors
+        to checked, unchecked or partially checked from their children.
+        Views get one ranged dataChanged per parent with changed children.
+        '''
+        value = QtCore.Qt.CheckState( value )
+        changed = {}
+        for node in nodes:
+            if getattr(node, 'checked', QtCore.Qt.Unchecked) != value:
+                self.setChecked( node, value )
+                self._markChanged( changed, node )
+            stack = [node]
+            while stack:
+                parent = stack.pop()
+                children = parent.children
+                for child in children:
+                    self.setChecked( child, value )
+                    if child.children:
+                        stack.append( child )
+                if children:
+                    self._markChanged( changed, children[0] )
+                    self._markChanged( changed, children[-1] )
+        self._updateParentStates( [node.parent for node in nodes], changed )
+        self._emitCheckChanges( changed )
+
+    def _childrenState( self, node ):
+        states = set( [getattr(child, 'checked', QtCore.Qt.Unchecked) for child in node.children] )
+        if states == set( [QtCore.Qt.Checked] ):
+            return QtCore.Qt.Checked
+        if not states or states == set( [QtCore.Qt.Unchecked] ):
+            return QtCore.Qt.Unchecked
+        return QtCore.Qt.PartiallyChecked
+
+    def _updateParentStates( self, parents, changed ):
+        # deepest parents first, so each one sees the new state of its
+        # children; roots have no check box
+        pending = set( [parent for parent in parents if parent and parent.parent] )
+        while pending:
+            depths = dict( [(parent, self._depth( parent )) for parent in pending] )
+            deepest = max( depths.values() )
+            for parent in [parent for parent, depth in depths.items() if depth == deepest]:
+                pending.discard( parent )
+                state = self._childrenState( parent )
+                if getattr(parent, 'checked', QtCore.Qt.Unchecked) != state:
+                    self.setChecked( parent, state )
+                    self._markChanged( changed, parent )
+                    if parent.parent.parent:
+                        pending.add( parent.parent )
+
+    def _depth( self, node ):
+        depth = 0
+        while node.parent:
+            node = node.parent
+            depth += 1
+        return depth
+
+    def _markChanged( self, changed, node ):
+        if not node.parent:
+            return
+        rows = changed.get( node.parent )
+        if rows:
+            rows[0] = min( rows[0], node.row )
+            rows[1] = max( rows[1], node.row )
+        else:
+            changed[node.parent] = [node.row, node.row]
+
+    def _emitCheckChanges( self, changed ):
+        roles = [QtCore.Qt.CheckStateRole]
+        for parent, (first, last) in changed.items():
+            parent_index = self.indexFromNode( parent )
+            if parent_index.isValid():
+                self.dataChanged.emit( self.index( first, 0, parent_index ), self.index( last, 0, parent_index ), roles )
+
+    def getCheckedNodes( self ):
+        '''
+        Returns the checked nodes still in the tree, in tree order.
+        '''
+        nodes = []
+        for node in list(self._checked):
+            key = self._treeKey( node )
+            if key is None:
+                self._checked.discard( node )
+            else:
+                nodes.append( (key, node) )
+        nodes.sort( key=lambda pair: pair[0] )
+        return [node for key, node in nodes]
+
+    def _treeKey( self, node ):
+        # rows from the root down, or None when node has left the tree
+        rows = []
+        child = node
+        while child.parent:
+            parent = child.parent
+            if child.row >= len(parent.children) or parent.children[child.row] is not child:
+                return None
+            rows.append( child.row )
+            child = parent
+        if child not in self.root_nodes:
+            return None
+        rows.append( self.root_nodes.index( child ) )
+        rows.reverse()
+        return rows
+
     def setImportDestination( self, folder ):
         if folder and folder != self.import_dest_folder:
             self.import_dest_folder = folder
-            self.refreshImportStatus()
+            self._setImported( folder, findImported( folder ) )
 
-    def getChildren( self, index, recursive=True ):
-        indexes = []
-        for i in range( self.rowCount( index ) ):
-            child = self.index( i, 0, index )
-            indexes.append( child )
-            if recursive:
-                indexes.extend( self.getChildren( child, True ) )
-        return indexes
+    def markImported( self, rel_paths ):
+        '''
+        Records images copied to the import destination.
+        '''
+        self._imported.update( rel_paths )
+        self.refreshImportStatus()
+
+    def _setImported( self, folder, rel_paths ):
+        if folder != self.import_dest_folder:
+            return
+        self._imported = rel_paths
+        self.refreshImportStatus()
 
     def refreshImportStatus( self ):
+        roles = [QtCore.Qt.DisplayRole, QtCore.Qt.ForegroundRole, QtCore.Qt.FontRole]
         for i in range(len(self.root_nodes)):
             root_index = self.index( i, 0, QtCore.QModelIndex() )
-            indexes = self.getChildren( root_index, True )
-            for index in indexes:
-                node = index.internalPointer()
-                if isinstance(node, PV_ImageItem):
-                    self.dataChanged.emit(
-                        index,
-                        index,
-                        [QtCore.Qt.DisplayRole, QtCore.Qt.ForegroundRole, QtCore.Qt.FontRole]
-                    )
+            self._refreshChildren( root_index, roles )
+
+    def _refreshChildren( self, index, roles ):
+        # one ranged dataChanged per group holding images
+        node = index.internalPointer()
+        children = node.children
+        if any( [isinstance(child, PV_ImageItem) for child in children] ):
+            self.dataChanged.emit( self.index( 0, 0, index ), self.index( len(children)-1, 0, index ), roles )
+        for child in children:
+            if child.children:
+                self._refreshChildren( self.index( child.row, 0, index ), roles )
 
     def _isImported( self, node ):
         if not self.import_dest_folder:
             return False
-        dest_path = os.path.join( self.import_dest_folder, node.path )
-        return os.path.exists( dest_path )
-            
+        return node.path in self._imported
 
     def _getRootNodes( self ):
         nodes = []
@@ -162,24 +532,11 @@ class PV_Model( QtCore.QAbstractItemModel ):
             if os.path.exists( root_dir ):
                 node = PV_RootItem( root_dir )
                 nodes.append( node )
+        for root_dir in config.data.get('movie_root_dirs') or []:
+            if os.path.exists( root_dir ):
+                nodes.append( PV_MovieRootItem( root_dir ) )
         return nodes
 
-    def _populateNodes( self ):
-        for root_node in self.root_nodes:
-            images = findImages( root_node.data )
-            items = []
-            for image in images:
-                try:
-                    item = getImageItem(image)
-                    items.append(item)
-                except Exception as err:
-                    logger.error(err)
-
-            dates = groupImagesByDay( items )
-            css = groupImagesByContinuousShooting( items )
-            for item in dates:
-                root_node.addChild(item)
-            
     def removeRows( self, row, count, parent=QtCore.QModelIndex() ):
         logger.debug('removeRows()...%d, %d' % (row, count))
         if not parent.isValid():
@@ -191,7 +548,70 @@ class PV_Model( QtCore.QAbstractItemModel ):
 
         self.beginRemoveRows(parent, row, row+count-1)
         children = node.children[row:row+count]
-        for child in children:
-            node.removeChild( child )
+        node.removeChildren( children )
+        self._forgetNodes( children )
         self.endRemoveRows()
         return True
+
+    def removeNodes( self, nodes ):
+        '''
+        Removes nodes from the tree, then the groups they leave empty. Rows
+        are removed with one beginRemoveRows per run of contiguous rows under
+        each parent, or, when a parent has more than REMOVE_RANGE_LIMIT runs,
+        with one removal of all its rows and one insertion of those kept.
+        '''
+        by_parent = {}
+        for node in nodes:
+            if node.parent:
+                by_parent.setdefault( node.parent, [] ).append( node )
+        remaining = []
+        while by_parent:
+            emptied = {}
+            for parent, children in by_parent.items():
+                self._removeChildren( parent, children )
+                if not parent.children and parent.parent:
+                    emptied.setdefault( parent.parent, [] ).append( parent )
+                else:
+                    remaining.append( parent )
+            by_parent = emptied
+
+        # the check state of the groups left depends on the removed rows
+        changed = {}
+        self._updateParentStates( [parent for parent in remaining if parent.children], changed )
+        self._emitCheckChanges( changed )
+
+    def _removeChildren( self, parent, children ):
+        parent_index = self.indexFromNode( parent )
+        rows = sorted( set( [child.row for child in children] ) )
+        ranges = []
+        for row in rows:
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append( [row, row] )
+
+        if len(ranges) > self.REMOVE_RANGE_LIMIT:
+            removed = set( children )
+            kept = [child for child in parent.children if child not in removed]
+            self.beginRemoveRows( parent_index, 0, len(parent.children)-1 )
+            parent.removeChildren( list( parent.children ) )
+            self.endRemoveRows()
+            if kept:
+                self.beginInsertRows( parent_index, 0, len(kept)-1 )
+                parent.addChildren( kept )
+                self.endInsertRows()
+        else:
+            # from the bottom, so the rows above stay valid
+            for first, last in reversed( ranges ):
+                self.beginRemoveRows( parent_index, first, last )
+                parent.removeChildren( parent.children[first:last+1] )
+                self.endRemoveRows()
+        self._forgetNodes( children )
+
+    def _forgetNodes( self, nodes ):
+        for node in nodes:
+            self._image_nodes.pop( node.data, None )
+            self._checked.discard( node )
+            for child in self._iterNodes( node ):
+                self._image_nodes.pop( child.data, None )
+                self._checked.discard( child )
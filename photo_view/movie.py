@@ -0,0 +1,71 @@
+import os
+import struct
+import datetime
+
+
+# QuickTime and MP4 times are seconds since 1904-01-01 UTC
+MOVIE_EPOCH = datetime.datetime( 1904, 1, 1 )
+
+
+def iterAtoms( fp, start, end ):
+    '''
+    Yields (type, data start, end) of the atoms between start and end,
+    reading only their headers and seeking over their data.
+    '''
+    offset = start
+    while offset + 8 <= end:
+        fp.seek( offset )
+        header = fp.read( 8 )
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack( '>I4s', header )
+        header_size = 8
+        if size == 1:
+            header = fp.read( 8 )
+            if len(header) < 8:
+                return
+            size = struct.unpack( '>Q', header )[0]
+            header_size = 16
+        elif size == 0:
+            # the last atom runs to the end of the file
+            size = end - offset
+        if size < header_size:
+            return
+        yield kind, offset + header_size, min( offset + size, end )
+        offset += size
+
+def parseMovieHeader( data ):
+    '''
+    Returns the creation time (naive UTC, None when unset) and the
+    duration in seconds from the content of an mvhd atom.
+    '''
+    version = data[0]
+    if version == 1:
+        creation, modification, timescale, duration = struct.unpack_from( '>QQIQ', data, 4 )
+    else:
+        creation, modification, timescale, duration = struct.unpack_from( '>IIII', data, 4 )
+    created = None
+    if creation:
+        created = MOVIE_EPOCH + datetime.timedelta( seconds=creation )
+    seconds = duration / float(timescale) if timescale else 0.0
+    return created, seconds
+
+def readMovieHeader( path ):
+    '''
+    Finds the mvhd atom in the moov atom of an MP4/MOV file, wherever moov
+    is in the file, reading a few hundred bytes.
+    '''
+    # unbuffered, so each seek reads only the header asked for
+    with open( path, 'rb', buffering=0 ) as fp:
+        end = os.fstat( fp.fileno() ).st_size
+        for kind, start, atom_end in iterAtoms( fp, 0, end ):
+            if kind != b'moov':
+                continue
+            for child, child_start, child_end in iterAtoms( fp, start, atom_end ):
+                if child == b'mvhd':
+                    fp.seek( child_start )
+                    data = fp.read( min( child_end - child_start, 112 ) )
+                    if data and len(data) >= (32 if data[0] == 1 else 20):
+                        return parseMovieHeader( data )
+            break
+    raise ValueError('No movie header in %s' % path)
@@ -0,0 +1,130 @@
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from .item import PV_ImageItem
+from .imaging import decodePreview, contactSheet, contactSheetCells
+from .store import getImageData
+from .cache import pixmap_cache, cacheKey
+from . import config
+from .logger import logger
+
+
+class PV_PrefetchSignals( QtCore.QObject ):
+    ready = QtCore.Signal( object, object )
+
+
+class PV_PrefetchJob( QtCore.QRunnable ):
+    def __init__( self, node, size, generation, prefetcher ):
+        super( PV_PrefetchJob, self ).__init__()
+        self.node = node
+        self.size = size
+        self.generation = generation
+        self.prefetcher = prefetcher
+        self.store = prefetcher.store
+        self.signals = prefetcher.signals
+
+    def run( self ):
+        if self.generation != self.prefetcher.generation:
+            return
+        try:
+            image = decodePreview( getImageData( self.node, 'preview', self.store ), self.node.orientation, self.size )
+        except Exception as err:
+            logger.error(err)
+            image = QtGui.QImage()
+        self.signals.ready.emit( cacheKey( self.node, 'preview', self.size ), image )
+
+
+class PV_ContactSheetJob( QtCore.QRunnable ):
+    def __init__( self, nodes, key, size, prefetcher ):
+        super( PV_ContactSheetJob, self ).__init__()
+        self.nodes = nodes
+        self.key = key
+        self.size = size
+        self.store = prefetcher.store
+        self.signals = prefetcher.signals
+
+    def run( self ):
+        cells = contactSheetCells( len(self.nodes), self.size )
+        images = []
+        for node, cell in zip( self.nodes, cells ):
+            try:
+                images.append( decodePreview( getImageData( node, 'preview', self.store ), node.orientation, cell.size() ) )
+            except Exception as err:
+                logger.error(err)
+                images.append( QtGui.QImage() )
+        self.signals.ready.emit( self.key, contactSheet( images, cells, self.size ) )
+
+
+class PV_PreviewPrefetcher( QtCore.QObject ):
+    '''
+    Decodes the previews of the 'preview_prefetch_count' images before and
+    after the current one into the pixmap cache. Jobs queued for an older
+    selection are dropped when the selection moves. Contact sheets of
+    continuous shooting groups are rendered on the same pool.
+    '''
+    previewReady = QtCore.Signal( object )
+
+    def __init__( self, store=None, parent=None ):
+        super( PV_PreviewPrefetcher, self ).__init__( parent )
+        self.store = store
+        self.count = config.data.get('preview_prefetch_count') or 0
+        self.sheet_frames = config.data.get('contact_sheet_frames') or 9
+        self.generation = 0
+        self.pool = QtCore.QThreadPool( self )
+        self.pool.setMaxThreadCount( config.data.get('preview_prefetch_workers') or 2 )
+        self._pending = set()
+        self.signals = PV_PrefetchSignals( self )
+        self.signals.ready.connect( self._ready )
+
+    def prefetch( self, node, size=None ):
+        '''
+        Queues the siblings of node, decoded to fit in size like the
+        preview of node (full resolution when size is None).
+        '''
+        self.generation += 1
+        self.pool.clear()
+        self._pending = set()
+        if not self.count or not isinstance( node, PV_ImageItem ) or not node.parent:
+            return
+
+        siblings = node.parent.children
+        row = node.row
+        nodes = []
+        for offset in range( 1, self.count + 1 ):
+            for sibling_row in (row + offset, row - offset):
+                if 0 <= sibling_row < len(siblings) and isinstance( siblings[sibling_row], PV_ImageItem ):
+                    nodes.append( siblings[sibling_row] )
+
+        # nearest siblings first, the next one before the previous one
+        priority = len(nodes)
+        for sibling in nodes:
+            key = cacheKey( sibling, 'preview', size )
+            if key not in self._pending and not pixmap_cache.contains( key ):
+                self._pending.add( key )
+                self.pool.start( PV_PrefetchJob( sibling, size, self.generation, self ), priority )
+            priority -= 1
+
+    def contactSheet( self, group, key, size ):
+        '''
+        Queues the contact sheet of the first 'contact_sheet_frames' images
+        of group, cached under key. previewReady is emitted once it is in
+        the pixmap cache.
+        '''
+        if key in self._pending or pixmap_cache.contains( key ):
+            return
+        nodes = [child for child in group.children[:self.sheet_frames] if isinstance( child, PV_ImageItem )]
+        if not nodes:
+            return
+        self._pending.add( key )
+        # ahead of the siblings queued by prefetch()
+        self.pool.start( PV_ContactSheetJob( nodes, key, size, self ), self.count * 2 + 1 )
+
+    def wait( self ):
+        self.generation += 1
+        self.pool.clear()
+        self.pool.waitForDone()
+
+    def _ready( self, key, image ):
+        self._pending.discard( key )
+        if not image.isNull() and pixmap_cache.insert( key, QtGui.QPixmap.fromImage( image ) ):
+            self.previewReady.emit( key )
@@ -0,0 +1,130 @@
+import os
+import hashlib
+import threading
+
+from . import config
+from . import pathutil
+from .logger import logger
+
+
+class PV_ThumbnailStore( object ):
+    '''
+    Directory of the embedded JPEG thumbnails and previews extracted from
+    the images, one file per image and variant, named by the hash of the
+    image path, size and mtime. The least recently read files are evicted
+    once the store grows over max_size bytes.
+    '''
+    def __init__( self, folder, max_size ):
+        self.folder = folder
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+        if not os.path.exists( folder ):
+            os.makedirs( folder )
+
+    def _path( self, node, variant ):
+        info = node.info
+        key = '%s\0%d\0%d\0%s' % (node.data, info.size, info.mtime, variant)
+        digest = hashlib.sha1( key.encode('utf-8', 'surrogateescape') ).hexdigest()
+        return os.path.join( self.folder, digest[:2], digest + '.jpg' )
+
+    def get( self, node, variant ):
+        path = self._path( node, variant )
+        try:
+            with open( path, 'rb' ) as fp:
+                data = fp.read()
+            os.utime( path )
+            return data
+        except OSError:
+            return None
+
+    def put( self, node, variant, data ):
+        path = self._path( node, variant )
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+        try:
+            folder = os.path.dirname( path )
+            if not os.path.exists( folder ):
+                os.makedirs( folder, exist_ok=True )
+            with open( tmp_path, 'wb' ) as fp:
+                fp.write( data )
+            os.replace( tmp_path, path )
+        except OSError as err:
+            logger.error(err)
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._getSize()
+            self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+    def fetch( self, node, variant ):
+        '''
+        Returns the stored data of node, extracting and storing it first
+        when it is missing.
+        '''
+        data = self.get( node, variant )
+        if data is None:
+            data = readImageData( node, variant )
+            if data:
+                self.put( node, variant, data )
+        return data
+
+    def _files( self ):
+        for entry in os.scandir( self.folder ):
+            if entry.is_dir():
+                for child in os.scandir( entry.path ):
+                    if child.name.endswith('.jpg'):
+                        yield child
+
+    def _getSize( self ):
+        return sum( [entry.stat().st_size for entry in self._files()] )
+
+    def _evict( self ):
+        files = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._files()]
+        files.sort()
+        size = sum( [file_size for mtime, file_size, path in files] )
+        target = self.max_size * 0.9
+        removed = 0
+        for mtime, file_size, path in files:
+            if size <= target:
+                break
+            try:
+                os.remove( path )
+            except OSError:
+                continue
+            size -= file_size
+            removed += 1
+        self._size = size
+        logger.debug('Evicted %d files from thumbnail store' % removed )
+
+
+def readImageData( node, variant ):
+    if variant == 'icon':
+        return node.thumbnail
+    return node.preview
+
+def getImageData( node, variant, store=None ):
+    '''
+    Returns the JPEG data of the icon or preview of node. Previews that
+    are the image file itself are read directly and never stored.
+    '''
+    if not store or (variant == 'preview' and node.PREVIEW_IS_FILE):
+        return readImageData( node, variant )
+    return store.fetch( node, variant )
+
+def openThumbnailStore():
+    '''
+    Opens the store configured by 'thumbnail_store', or returns None when
+    it is disabled.
+    '''
+    folder = config.data.get('thumbnail_store')
+    if not folder:
+        return None
+    folder = pathutil.resolvePackagePath( folder )
+    max_size = (config.data.get('thumbnail_store_size') or 1048576) * 1024
+    try:
+        return PV_ThumbnailStore( folder, max_size )
+    except OSError as err:
+        logger.error('Unable to open thumbnail store %s: %s' % (folder, err))
+        return None
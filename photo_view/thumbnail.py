@@ -0,0 +1,84 @@
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from . import config
+from .store import getImageData
+from .logger import logger
+
+import collections
+
+
+class PV_ThumbnailSignals( QtCore.QObject ):
+    ready = QtCore.Signal( object, object )
+
+
+class PV_ThumbnailJob( QtCore.QRunnable ):
+    def __init__( self, node, signals, store=None ):
+        super( PV_ThumbnailJob, self ).__init__()
+        self.setAutoDelete( False )
+        self.node = node
+        self.signals = signals
+        self.store = store
+
+    def run( self ):
+        image = QtGui.QImage()
+        try:
+            image.loadFromData( getImageData( self.node, 'icon', self.store ) )
+        except Exception as err:
+            logger.error(err)
+        self.signals.ready.emit( self.node, image )
+
+
+class PV_ThumbnailService( QtCore.QObject ):
+    '''
+    Decodes the embedded thumbnails on a thread pool. The most recent
+    requests run first, so the rows being painted are served before rows
+    that were scrolled past, and only the newest 'thumbnail_queue_size'
+    requests are kept queued.
+    '''
+    thumbnailReady = QtCore.Signal( object, QtGui.QPixmap )
+
+    def __init__( self, store=None, parent=None ):
+        super( PV_ThumbnailService, self ).__init__( parent )
+        self.store = store
+        self.pool = QtCore.QThreadPool( self )
+        self.pool.setMaxThreadCount( config.data.get('thumbnail_workers') or 2 )
+        self.queue_size = config.data.get('thumbnail_queue_size') or 200
+        self._jobs = collections.OrderedDict()
+        self._failed = set()
+        self._priority = 0
+        self.signals = PV_ThumbnailSignals( self )
+        self.signals.ready.connect( self._ready )
+
+    def request( self, node ):
+        if node in self._jobs or node in self._failed:
+            return
+        self._priority += 1
+        job = PV_ThumbnailJob( node, self.signals, self.store )
+        self._jobs[node] = job
+        self.pool.start( job, self._priority )
+
+        # drop the oldest requests that have not started yet
+        excess = len(self._jobs) - self.queue_size
+        if excess > 0:
+            for old_node, old_job in list( self._jobs.items() )[:excess]:
+                if self.pool.tryTake( old_job ):
+                    del self._jobs[old_node]
+
+    def clear( self ):
+        # running jobs still report back, and are ignored by _ready's caller
+        # once their nodes have left the model
+        self.pool.clear()
+        self._jobs = collections.OrderedDict()
+        self._failed = set()
+
+    def wait( self ):
+        self.pool.clear()
+        self.pool.waitForDone()
+
+    def _ready( self, node, image ):
+        self._jobs.pop( node, None )
+        if image.isNull():
+            self._failed.add( node )
+            return
+        self.thumbnailReady.emit( node, QtGui.QPixmap.fromImage( image ) )
@@ -0,0 +1,171 @@
+from PySide6 import QtCore
+
+from .item import getImageSuffixes, scanImages, TRASH_FOLDER
+from . import config
+from .logger import logger
+
+import os
+import time
+
+
+class PV_FileWatcher( QtCore.QObject ):
+    '''
+    Watches the directories under the image roots and reports the images
+    added and removed since the last snapshot of each directory.
+    A modified file is reported as removed and added again.
+    '''
+    changed = QtCore.Signal( str, object, object )
+
+    def __init__( self, parent=None ):
+        super( PV_FileWatcher, self ).__init__( parent )
+        self._snapshots = {}
+        self._roots = {}
+        self._pending = set()
+        self._enabled = False
+        self.suffixes = getImageSuffixes()
+        self.settle_sec = config.data.get('watch_settle_sec') or 1
+
+        self._watcher = QtCore.QFileSystemWatcher( self )
+        self._watcher.directoryChanged.connect( self._directoryChanged )
+        self._timer = QtCore.QTimer( self )
+        self._timer.setSingleShot( True )
+        self._timer.setInterval( config.data.get('watch_delay_msec') or 200 )
+        self._timer.timeout.connect( self._update )
+
+    def setEnabled( self, value ):
+        if value == self._enabled:
+            return
+        self._enabled = value
+        if value:
+            self._addPaths( list(self._snapshots) )
+        else:
+            self._removePaths( list(self._snapshots) )
+            self._pending = set()
+            self._timer.stop()
+
+    def isEnabled( self ):
+        return self._enabled
+
+    def watch( self, root_dir, snapshot ):
+        '''
+        Starts watching root_dir. snapshot maps each directory to a dict
+        of {image name: (size, mtime)}.
+        '''
+        for path, images in snapshot.items():
+            self._snapshots[path] = dict(images)
+            self._roots[path] = root_dir
+        if self._enabled:
+            self._addPaths( list(snapshot) )
+
+    def clear( self ):
+        self._removePaths( list(self._snapshots) )
+        self._snapshots = {}
+        self._roots = {}
+        self._pending = set()
+        self._timer.stop()
+
+    def _addPaths( self, paths ):
+        if paths:
+            self._watcher.addPaths( paths )
+
+    def _removePaths( self, paths ):
+        watched = set( self._watcher.directories() )
+        paths = [path for path in paths if path in watched]
+        if paths:
+            self._watcher.removePaths( paths )
+
+    def _directoryChanged( self, path ):
+        logger.debug('directoryChanged: %s' % path )
+        self._pending.add( path )
+        self._timer.start()
+
+    def _update( self ):
+        pending = self._pending
+        self._pending = set()
+        changes = {}
+        for path in sorted(pending):
+            self._diff( path, changes )
+
+        # files still being written are checked again on the next round
+        if self._pending:
+            self._timer.start()
+
+        for root_dir, (added, removed) in changes.items():
+            if added or removed:
+                logger.debug('%s: %d added, %d removed' % (root_dir, len(added), len(removed)))
+                self.changed.emit( root_dir, added, removed )
+
+    def _diff( self, path, changes ):
+        root_dir = self._roots.get( path )
+        if root_dir is None:
+            return
+        added, removed = changes.setdefault( root_dir, ([], []) )
+        if not os.path.isdir( path ):
+            self._forget( path, removed )
+            return
+
+        old = self._snapshots.get( path, {} )
+        new = {}
+        subdirs = set()
+        now = time.time()
+        try:
+            with os.scandir( path ) as it:
+                for entry in it:
+                    name = entry.name
+                    if entry.is_dir():
+                        if not entry.is_symlink() and name != TRASH_FOLDER:
+                            subdirs.add( entry.path )
+                        continue
+                    if name[name.rfind('.'):].lower() not in self.suffixes:
+                        continue
+                    stat = entry.stat()
+                    if now - stat.st_mtime < self.settle_sec:
+                        self._pending.add( path )
+                        if name in old:
+                            new[name] = old[name]
+                        continue
+                    new[name] = (stat.st_size, stat.st_mtime_ns)
+                    if old.get( name ) != new[name]:
+                        if name in old:
+                            removed.append( entry.path )
+                        added.append( entry )
+        except OSError as err:
+            logger.error(err)
+            return
+
+        for name in old:
+            if name not in new:
+                removed.append( os.path.join( path, name ) )
+        self._snapshots[path] = new
+
+        known = set( [child for child in self._snapshots if os.path.dirname(child) == path] )
+        for child in known - subdirs:
+            self._forget( child, removed )
+        for child in sorted( subdirs - known ):
+            self._scan( child, root_dir, added )
+
+    def _scan( self, path, root_dir, added ):
+        dirs = []
+        now = time.time()
+        for entry in scanImages( [path], self.suffixes, dirs ):
+            stat = entry.stat()
+            folder = os.path.dirname( entry.path )
+            if now - stat.st_mtime < self.settle_sec:
+                self._pending.add( folder )
+                continue
+            self._snapshots.setdefault( folder, {} )[entry.name] = (stat.st_size, stat.st_mtime_ns)
+            added.append( entry )
+        for child in dirs:
+            self._snapshots.setdefault( child, {} )
+            self._roots[child] = root_dir
+        if self._enabled:
+            self._addPaths( dirs )
+
+    def _forget( self, path, removed ):
+        prefix = path + os.sep
+        paths = [child for child in self._snapshots if child == path or child.startswith(prefix)]
+        for child in paths:
+            for name in self._snapshots.pop( child ):
+                removed.append( os.path.join( child, name ) )
+            del self._roots[child]
+        self._removePaths( paths )
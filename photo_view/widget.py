@@ -2,17 +2,43 @@ from PySide6 import QtWidgets
 from PySide6 import QtCore
 from PySide6 import QtGui
 
-from .item import PV_ImageItem, PV_ContinuousShootGroupItem
+from .item import PV_ImageItem, PV_ContinuousShootGroupItem, PV_MovieItem
 from . import config
 from .model  import PV_Model
 from . import pathutil
+from .cache import pixmap_cache, cacheKey, scaledKey
+from .store import getImageData
+from .imaging import decodePreview, decodeSize
+from .prefetch import PV_PreviewPrefetcher
+from .importer import PV_Importer
+from .deleter import PV_Deleter
 from .logger import logger
 
 import os
-import shutil
-import filecmp
+import subprocess
+
+class PV_ImportWorker( QtCore.QObject ):
+    '''
+    Runs a PV_Importer on a QThread, reporting its stats.
+    '''
+    progress = QtCore.Signal( object )
+    finished = QtCore.Signal( object, object )
+
+    def __init__( self, importer, files, action ):
+        super( PV_ImportWorker, self ).__init__()
+        self.importer = importer
+        self.files = files
+        self.action = action
+
+    @QtCore.Slot()
+    def run( self ):
+        copied, stats = [], None
+        try:
+            copied, stats = self.importer.run( self.files, self.action, self.progress.emit )
+        except Exception as err:
+            logger.error(err)
+        self.finished.emit( copied, stats )
 
-QtGui.QPixmapCache.setCacheLimit( config.data.get('pixmap_cache_size') or 10240*100 )
 
 class PV_Label( QtWidgets.QLabel ):
     doubleClicked = QtCore.Signal()
@@ -26,6 +52,8 @@ class PV_TreeView( QtWidgets.QTreeView ):
         icon_size = config.data.get('icon_size') or 32
         self.setIconSize( QtCore.QSize( icon_size, icon_size ) )
         self.setSelectionMode( QtWidgets.QAbstractItemView.ExtendedSelection )
+        # only the painted rows are asked for their icons
+        self.setUniformRowHeights( True )
         
 class PV_MainWindow( QtWidgets.QMainWindow ):
 
@@ -40,6 +68,13 @@ class PV_MainWindow( QtWidgets.QMainWindow ):
         self.tree_view = PV_TreeView( self )
         self.model = PV_Model(self)
         self.tree_view.setModel( self.model )
+        self.prefetcher = PV_PreviewPrefetcher( self.model.thumbnail_store, self )
+        self.composite_style = config.data.get('composite_style') or 'stack'
+        self.preview_state = None
+        self.import_thread = None
+        self.deleter = PV_Deleter( self )
+        self.deleter.finished.connect( self.deleteFinished )
+        self.deleter.emptyTrash( [root_node.data for root_node in self.model.root_nodes] )
         self.scroll_area = QtWidgets.QScrollArea( self )
         #self.image_label = QtWidgets.QLabel()
         self.image_label = PV_Label()
@@ -60,16 +95,28 @@ class PV_MainWindow( QtWidgets.QMainWindow ):
         main_layout.addWidget( splitter, 0, 0, 1, 1 )
         main_layout.addWidget( button_box, 1, 0, 1, 1 )
 
+        self.load_progress = QtWidgets.QProgressBar( self )
+        self.load_progress.setMaximumWidth( 200 )
+        self.statusBar().addPermanentWidget( self.load_progress )
+
         close_button.clicked.connect( self.close )
         copy_button.clicked.connect( self.copy )
         delete_button.clicked.connect( self.delete )
         
         self.model.checkStateChanged.connect( self.updateCheckboxes )
+        self.model.loadProgress.connect( self.updateLoadProgress )
+        self.model.loadFinished.connect( self.loadFinished )
         self.tree_view.selectionModel().currentChanged.connect( self.updatePreview )
+        self.prefetcher.previewReady.connect( self.previewReady )
         splitter.splitterMoved.connect( self.adjustPreviewSize )
         self.tree_view.doubleClicked.connect( self.treeDoubleClicked )
         self.image_label.doubleClicked.connect( self.previewDoubleClicked )
         
+        self.settle_timer = QtCore.QTimer( self )
+        self.settle_timer.setSingleShot( True )
+        self.settle_timer.setInterval( config.data.get('preview_settle_msec') or 150 )
+        self.settle_timer.timeout.connect( self.fitPreviewImageToWindow )
+
         self.resize( 1024, 1024 )
         
         QtGui.QShortcut( QtGui.QKeySequence('return'), self.tree_view, self.toggle )
@@ -95,22 +142,48 @@ class PV_MainWindow( QtWidgets.QMainWindow ):
         scale050_action.triggered.connect( self.scale050 )
         scale050_action.setShortcut( 'Ctrl+2' )
         option_menu.addSeparator()
+        watch_action = option_menu.addAction('Watch Folders')
+        watch_action.setCheckable( True )
+        watch_action.setChecked( self.model.watcher.isEnabled() )
+        watch_action.toggled.connect( self.model.setWatching )
         reset_action = option_menu.addAction('Reset')
         reset_action.triggered.connect( self.resetModel )
         reset_action.setShortcut('Ctrl+r')
 
+    def updateLoadProgress( self, value, total ):
+        # total is 0 while the roots are still being scanned
+        self.load_progress.setRange( 0, total )
+        self.load_progress.setValue( value )
+        self.load_progress.show()
+        self.statusBar().showMessage( 'Loading... %d images' % value )
+
+    def loadFinished( self ):
+        self.load_progress.hide()
+        self.statusBar().clearMessage()
+
+    def closeEvent( self, event ):
+        if self.import_thread and self.import_thread.isRunning():
+            self.importer.cancel()
+            self.import_thread.quit()
+            self.import_thread.wait()
+        self.prefetcher.wait()
+        self.deleter.wait()
+        self.model.close()
+        super( PV_MainWindow, self ).closeEvent( event )
+
     def treeDoubleClicked( self, index ):
         if not index.isValid():
             return
         node = index.internalPointer()
-        if isinstance( node, PV_ImageItem ):
-            os.system( 'open %s' % node.data )
+        if isinstance( node, (PV_ImageItem, PV_MovieItem) ):
+            # no shell, so paths with spaces or quotes open as they are
+            subprocess.Popen( ['open', node.data] )
 
     def previewDoubleClicked( self, *args ):
         index = self.tree_view.currentIndex()
         node = index.internalPointer()
         if isinstance( node, PV_ImageItem ):
-            os.system( 'open %s' % node.data )
+            subprocess.Popen( ['open', node.data] )
 
 
     def updatePreview( self, *args ):
@@ -120,39 +193,98 @@ class PV_MainWindow( QtWidgets.QMainWindow ):
         if node:
             logger.debug('  name: %s' % node.name )
         fit = self.auto_fit_action.isChecked()
+        # prefetch() drops the queued jobs, so it goes first to keep the
+        # contact sheet queued by showPreviewImage()
+        self.prefetcher.prefetch( node, self.getDecodeSize( node, fit ) )
         self.showPreviewImage( node, fit )
 
-    def getPixmap( self, node ):
+    def previewReady( self, key ):
+        if not self.preview_state:
+            return
+        node, fit, scale = self.preview_state
+        if key == self.getPixmapKey( node, self.getDecodeSize( node, fit, scale ) ):
+            self.showPreviewImage( node, fit, scale )
+
+    def getFullSize( self, node ):
+        if not isinstance( node, PV_ImageItem ):
+            return None
+        width, height = node.preview_size
+        if not width or not height:
+            return None
+        if node.orientation in (5, 6, 7, 8):
+            width, height = height, width
+        return QtCore.QSize( width, height )
+
+    def getDecodeSize( self, node, fit=False, scale=100 ):
+        '''
+        Returns the size previews are decoded to for display, or None when
+        the full resolution is needed (100% and above). Group composites
+        are always rendered at the size of the preview area.
+        '''
+        if fit or isinstance( node, PV_ContinuousShootGroupItem ):
+            return decodeSize( self.scroll_area.size() )
+        full_size = self.getFullSize( node )
+        if scale < 100 and full_size:
+            return decodeSize( full_size * scale / 100.0 )
+        return None
+
+    def getPixmapKey( self, node, size=None ):
+        if isinstance( node, PV_ImageItem ):
+            return cacheKey( node, 'preview', size )
+        elif isinstance( node, PV_ContinuousShootGroupItem ) and node.children:
+            return cacheKey( node.children[0], 'composite', size )
+        return None
+
+    def getPixmap( self, node, size=None ):
         if not node:
             return
         logger.debug('getPixmap()... %s' % node.name )
         pm = QtGui.QPixmap()
-        key = node.name
-        if not QtGui.QPixmapCache.find( key, pm ):
+        key = self.getPixmapKey( node, size )
+        if not key:
+            return pm
+
+        cached = pixmap_cache.find( key )
+        if cached is None:
             if isinstance( node, PV_ImageItem ):
-                pm.loadFromData( node.preview )
-                pm = orientPixmap( pm, node.orientation )
-            elif isinstance( node, PV_ContinuousShootGroupItem ):
-                pm  = self.compositeSeqImages( node )
-            QtGui.QPixmapCache.insert( key, pm )
+                data = getImageData( node, 'preview', self.model.thumbnail_store )
+                pm = QtGui.QPixmap.fromImage( decodePreview( data, node.orientation, size ) )
+            elif self.composite_style == 'contact_sheet':
+                # the stack is shown until the sheet is rendered
+                self.prefetcher.contactSheet( node, key, size )
+                return self.compositeSeqImages( node, size )
+            else:
+                pm  = self.compositeSeqImages( node, size )
+            pixmap_cache.insert( key, pm )
         else:
-            logger.debug('Hit from cache: %s' % key )
+            logger.debug('Hit from cache: %s' % node.name )
+            pm = cached
+        logger.debug('Pixmap cache: %s' % pixmap_cache.stats() )
         return pm
         
 
-    def compositeSeqImages( self, node ):
+    def compositeSeqImages( self, node, size=None ):
+        '''
+        Draws the first image of the group over a stack of frames, made
+        from its preview decoded for display and fitting in size.
+        '''
         logger.debug('compositeSeqImages()...%s' % node.name)
         child = node.children[0]
-        pixmap = self.getPixmap( child )
-        out_image = QtGui.QImage( pixmap.size(), QtGui.QImage.Format_ARGB32_Premultiplied )
+        pixmap = self.getPixmap( child, size )
+        margin = QtCore.QSize( 100, 100 )
+        if size and bool(pixmap):
+            fit_size = (size - margin).expandedTo( QtCore.QSize( 1, 1 ) )
+            if pixmap.width() > fit_size.width() or pixmap.height() > fit_size.height():
+                pixmap = pixmap.scaled( fit_size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation )
 
         source_size = pixmap.size()
-        dest_size =  source_size + QtCore.QSize( 100, 100 )
-        out_image = QtGui.QImage( dest_size, QtGui.QImage.Format_ARGB32_Premultiplied )
+        dest_size =  source_size + margin
+        out_pixmap = QtGui.QPixmap( dest_size )
+        out_pixmap.fill( QtCore.Qt.transparent )
 
         brush = QtGui.QBrush( QtCore.Qt.gray, QtCore.Qt.SolidPattern )
         painter = QtGui.QPainter()
-        painter.begin( out_image )
+        painter.begin( out_pixmap )
         painter.setCompositionMode( QtGui.QPainter.CompositionMode_Source )
 
         painter.setBrush( brush )
@@ -163,70 +295,56 @@ class PV_MainWindow( QtWidgets.QMainWindow ):
         painter.drawPixmap( 0, 0, pixmap )
         painter.end()
         
-        return QtGui.QPixmap.fromImage( out_image, QtCore.Qt.AutoColor )
+        return out_pixmap
 
-    def showPreviewImage( self, node, fit=False, scale=100 ):
-        pm = self.getPixmap( node )
+    def showPreviewImage( self, node, fit=False, scale=100, fast=False ):
+        self.preview_state = (node, fit, scale)
+        decode_size = self.getDecodeSize( node, fit, scale )
+        pm = self.getPixmap( node, decode_size )
         if not bool(pm):
             self.image_label.clear()
             return
 
         scale_size = None
         if fit:
-            scale_size = self.scroll_area.size()
+            scale_size = pm.size().scaled( self.scroll_area.size(), QtCore.Qt.KeepAspectRatio )
         elif scale != 100:
-            scale_size = pm.size() * scale / 100.0
+            scale_size = (self.getFullSize( node ) or pm.size()) * scale / 100.0
 
-        if scale_size:
-            pm = pm.scaled( scale_size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation )
+        if scale_size and scale_size != pm.size():
+            pm = self.getScaledPixmap( node, pm, scale_size, fast, decode_size )
                 
         self.image_label.setPixmap( pm )
         self.image_label.adjustSize()
         
         
-    def updateCheckboxes( self, *args ):
-        logger.debug('updateCheckboxes()...')
-        curr = args[0]
-        node = curr.internalPointer()
-        model = self.tree_view.model()
-
-        if model.rowCount( curr ) > 0:
-            self.updateDecendantCheckboxes( curr )
-            
-        selected = self.tree_view.selectedIndexes()
-        if curr not in selected:
+    def getScaledPixmap( self, node, pm, size, fast=False, decode_size=None ):
+        '''
+        Returns pm scaled to size. Smooth results are cached; fast ones are
+        only used while the window or the splitter is being dragged.
+        '''
+        if fast:
+            return pm.scaled( size, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.FastTransformation )
+        key = scaledKey( self.getPixmapKey( node, decode_size ), size )
+        cached = pixmap_cache.find( key )
+        if cached is None:
+            cached = pm.scaled( size, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation )
+            pixmap_cache.insert( key, cached )
+        return cached
+
+    def updateCheckboxes( self, index ):
+        '''
+        Applies the check state set on index to the other selected rows.
+        '''
+        selected = self.tree_view.selectionModel().selectedRows()
+        if index not in selected or len(selected) < 2:
             return
-        
-        # multi selection
         logger.debug('Num of selected: %d' % len(selected) )
-        for index in selected:
-            item = index.internalPointer()
-            item.checked = node.checked
-            model.dataChanged.emit(index, index)
-            if model.rowCount( index ) > 0:
-                self.updateDecendantCheckboxes( index )
-                
-    def updateDecendantCheckboxes( self, index ):
-        model = self.tree_view.model()
-        node = index.internalPointer()
-        children = model.getChildren( index )
-        for child in children:
-            child.internalPointer().checked = node.checked
-            model.dataChanged.emit(child, child)                
-
-
-    def getCheckedIndexes( self ):
-        model = self.tree_view.model()
-        indexes = model.match( model.index(0, 0),
-                               QtCore.Qt.CheckStateRole,
-                               QtCore.Qt.Checked,
-                               -1,
-                               QtCore.Qt.MatchRecursive )
-        return indexes
+        value = self.model.data( index, QtCore.Qt.CheckStateRole )
+        self.model.setCheckState( [selected_index.internalPointer() for selected_index in selected], value )
 
     def getCheckedImages( self, check_error=True ):
-        indexes = self.getCheckedIndexes()
-        nodes = [index.internalPointer() for index in indexes]
+        nodes = self.model.getCheckedNodes()
         nodes = [node for node in nodes if isinstance( node, PV_ImageItem)]
 
         if check_error:
@@ -263,6 +381,8 @@ class PV_MainWindow( QtWidgets.QMainWindow ):
         if any([os.path.exists(path) for path in dest_paths] ):
             msg = QtWidgets.QMessageBox()
             msg.setText('Some images already exist')
+            if config.data.get('import_dedupe'):
+                msg.setInformativeText('Images identical to one already imported are never copied again.')
             replace_button = msg.addButton('Replace', QtWidgets.QMessageBox.YesRole)
             skip_button = msg.addButton('Skip', QtWidgets.QMessageBox.NoRole)
             cancel_button = msg.addButton('Cancel', QtWidgets.QMessageBox.RejectRole)
@@ -276,38 +396,58 @@ class PV_MainWindow( QtWidgets.QMainWindow ):
                 action = 'skip'
             logger.debug('existing file action: %s' % action )
 
-        src_paths = [node.data for node in nodes]
+        files = [(node.data, rel_path) for node, rel_path in zip(nodes, rel_paths)]
+        self.startImport( folder, files, action )
 
-        progress = QtWidgets.QProgressDialog("Copy Images", "Cancel", 0, len(nodes), self )
+    def startImport( self, folder, files, action ):
+        '''
+        Copies files on a PV_ImportWorker thread, behind a modal progress
+        dialog showing the throughput.
+        '''
+        progress = QtWidgets.QProgressDialog("Copy Images", "Cancel", 0, len(files), self )
         progress.setWindowModality( QtCore.Qt.WindowModal )
-        progress.show()
-        
-        for i, (src, dst) in enumerate(zip(src_paths, dest_paths)):
-            progress.setValue(i)
-            if progress.wasCanceled():
-                break
-            
-            if not os.path.exists(os.path.dirname(dst)):
-                os.mkdir( os.path.dirname(dst) )
-
-            if os.path.exists( dst ):
-                if action == 'replace':
-                    os.remove( dst )
-                else:
-                    continue
-            logger.debug('Copying from %s to %s' % (src, dst))
-            shutil.copy2( src, dst )
-
-        progress.setValue(len(nodes))
-        self.model.refreshImportStatus()
-        
+        progress.setMinimumDuration( 0 )
+        progress.setValue( 0 )
+
+        importer = PV_Importer( folder, index=self.model.metadata_index )
+        thread = QtCore.QThread( self )
+        worker = PV_ImportWorker( importer, files, action )
+        worker.moveToThread( thread )
+        thread.started.connect( worker.run )
+        worker.progress.connect( self.updateImportProgress )
+        worker.finished.connect( thread.quit )
+        worker.finished.connect( self.importFinished )
+        thread.finished.connect( worker.deleteLater )
+        progress.canceled.connect( importer.cancel )
+        self.import_progress = progress
+        self.importer = importer
+        self.import_worker = worker
+        self.import_thread = thread
+        thread.start()
+
+    def updateImportProgress( self, stats ):
+        self.import_progress.setValue( stats.files )
+        self.import_progress.setLabelText( 'Copy Images\n%d / %d files, %.1f MB/s, %.1f files/s' % (stats.files,
+                                                                                                   stats.total_files,
+                                                                                                   stats.mb_per_sec,
+                                                                                                   stats.files_per_sec) )
+
+    def importFinished( self, copied, stats ):
+        # closing the dialog emits canceled
+        self.import_progress.canceled.disconnect()
+        self.import_progress.reset()
+        self.import_progress.deleteLater()
+        if stats:
+            logger.debug('Import: %s' % stats.summary() )
+            self.statusBar().showMessage( 'Imported %d files, %.1f MB/s, %d already imported' % (stats.copied_files,
+                                                                                                  stats.mb_per_sec,
+                                                                                                  stats.duplicates), 5000 )
+        self.model.markImported( copied )
+
 
     def delete( self, *args ):
         logger.debug('Delete()...')
-        indexes = self.getCheckedIndexes()
-
-        nodes = [index.internalPointer() for index in indexes]
-        nodes = [node for node in nodes if isinstance( node, PV_ImageItem)]
+        nodes = self.getCheckedImages( check_error=False )
 
         if not nodes:
             return
@@ -317,42 +457,15 @@ class PV_MainWindow( QtWidgets.QMainWindow ):
         if ret != QtWidgets.QMessageBox.Yes:
             return
 
-        model = self.tree_view.model()
-
-        indexes.sort( key=lambda item: item.row(), reverse=True )
-
-        parents = set()
-        for index in indexes:
+        # the rows go at once, the files are deleted in the background
+        paths = [node.data for node in nodes]
+        self.model.removeNodes( nodes )
+        self.deleter.delete( paths, [root_node.data for root_node in self.model.root_nodes] )
 
-            # remove the item from the model
-            parent = index.parent()
-            logger.debug('removeRow: %s row:%d, parent:%s' % (model.data(index), index.row(), model.data(parent)))
-            ret = model.removeRow( index.row(), parent )
-            logger.debug( "removeRow: %s" % str(ret) )
-            # if parent has no children, remove from the model later
-            if not parent.internalPointer().children:
-                parents.add( parent )
-
-            # actually deleting image file
-            node = index.internalPointer()
-            if isinstance( node, PV_ImageItem ):
-                logger.debug('Deleting %s' % node.data )
-                os.remove( node.data )
-
-        # clean up groups with no children
-        logger.debug('Parents with no child: %d' % len(parents))
-        parents = list(parents)
-        parents.sort( key=lambda item: item.row(), reverse=True )
-        for index in parents:
-            if index in indexes:
-                continue
-            
-            node = index.internalPointer()
-            if not node.children:
-                logger.debug("removeRow(parent): %s" % model.data(index) )
-                ret = model.removeRow( index.row(), index.parent() )
-                logger.debug("removeRow(parent): %s" % str(ret) )
-        
+    def deleteFinished( self, deleted, failed ):
+        logger.debug('Deleted %d files, %d failed' % (deleted, failed))
+        if failed:
+            self.statusBar().showMessage( 'Unable to delete %d files' % failed, 5000 )
 
     def toggle( self, *args ):
         logger.debug('Toggle()...')
@@ -363,7 +476,7 @@ class PV_MainWindow( QtWidgets.QMainWindow ):
                 return
             checked = self.tree_view.model().data( index, QtCore.Qt.CheckStateRole )
             new_value = QtCore.Qt.Checked
-            if checked:
+            if checked == QtCore.Qt.Checked:
                 new_value = QtCore.Qt.Unchecked
 
             self.tree_view.model().setData( index, new_value, QtCore.Qt.CheckStateRole )
@@ -375,7 +488,10 @@ class PV_MainWindow( QtWidgets.QMainWindow ):
 
     def adjustPreviewSize( self, *args ):
         if self.auto_fit_action.isChecked():
-            self.fitPreviewImageToWindow()
+            # fast scaling while dragging, one smooth pass once it settles
+            index = self.tree_view.currentIndex()
+            self.showPreviewImage( index.internalPointer(), True, fast=True )
+            self.settle_timer.start()
 
     def fitPreviewImageToWindow( self, *args ):
         logger.debug('fitPreviewImageToWindow()...')
@@ -400,30 +516,3 @@ class PV_MainWindow( QtWidgets.QMainWindow ):
 
     def resetModel( self, *args ):
         self.tree_view.model().reset()
-        
-        
-
-
-def orientPixmap( pixmap, exif_orientation ):
-    if exif_orientation == 2:
-        pixmap = pixmap.transformed( QtGui.QTransform().scale(-1, 1) )
-    elif exif_orientation == 3:
-        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 180 ) )
-    elif exif_orientation == 4:
-        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 180 ) )
-        pixmap = pixmap.transformed( QtGui.QTransform().scale(-1, 1) )
-    elif exif_orientation == 5:
-        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 90 ) )
-        pixmap = pixmap.transformed( QtGui.QTransform().scale(-1, 1) )
-    elif exif_orientation == 6:
-        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 90 ) )
-    elif exif_orientation == 7:
-        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 270 ) )
-        pixmap = pixmap.transformed( QtGui.QTransform().scale(-1, 1) )
-    elif exif_orientation == 8:
-        pixmap = pixmap.transformed( QtGui.QTransform().rotate( 270 ) )
-
-    return pixmap
-
-
-        